@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Epoch throughput of the wandb_example data loaders on CPU.
+
+Each --data_mode of get_dataloaders (and the torchvision mode with batched
+transforms) is timed over full epochs of the training loader (the first epoch
+of the tensor mode may include the one-time decoding of the dataset, it is
+reported separately).
+
+    python benchmarks/bench_data_loading.py --epochs 3 --batch_size 128
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from wandb_example import get_dataloaders, get_loader_kwargs  # noqa: E402
+
+# (name, data_mode, batch_transforms)
+PIPELINES = (
+    ("torchvision", "torchvision", False),
+    ("batched", "torchvision", True),
+    ("tensor", "tensor", False),
+)
+
+
+def time_epoch(loader):
+    """Returns (seconds, samples) of one pass over the loader."""
+    samples = 0
+    start = time.perf_counter()
+    for images, labels in loader:
+        samples += labels.size(0)
+    return time.perf_counter() - start, samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--epochs", type=int, default=3, help="timed epochs")
+    parser.add_argument("--batch_size", type=int, default=128)
+    parser.add_argument("--data_dir", default="./data")
+    parser.add_argument(
+        "--num_workers", type=int, default=0, help="-1: the allocated CPUs"
+    )
+    args = parser.parse_args()
+    loader_kwargs = get_loader_kwargs(num_workers=args.num_workers)
+
+    results = {}
+    for name, data_mode, batch_transforms in PIPELINES:
+        start = time.perf_counter()
+        train_loader, _, _ = get_dataloaders(
+            args.batch_size,
+            data_mode=data_mode,
+            data_dir=args.data_dir,
+            loader_kwargs=loader_kwargs,
+            batch_transforms=batch_transforms,
+        )
+        setup = time.perf_counter() - start
+        first, samples = time_epoch(train_loader)
+        epochs = [time_epoch(train_loader)[0] for _ in range(args.epochs)]
+        results[name] = min(epochs)
+        print(
+            f"{name:<12} setup {setup:6.2f} s   first epoch {first:6.2f} s   "
+            f"best epoch {min(epochs):6.2f} s   {samples / min(epochs):>10,.0f} samples/s"
+        )
+
+    baseline = results["torchvision"]
+    for name, seconds in results.items():
+        print(f"{name:<12} speedup x{baseline / seconds:.1f}")
+
+
+if __name__ == "__main__":
+    main()
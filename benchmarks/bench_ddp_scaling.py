@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Data-parallel scaling of the wandb_example training on CPU.
+
+The training loop of wandb_example (MLP, Adam, DistributedDataParallel with
+the gloo backend) is run with 1, 2, 4 ... processes on this node, each one
+with its share of the CPUs, and the best epoch time is compared to the single
+process one. The batch size is per process, so the global batch grows with
+the number of processes.
+
+    python benchmarks/bench_ddp_scaling.py --processes 1 2 4 --epochs 2
+"""
+
+import argparse
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import torch  # noqa: E402
+import torch.distributed as dist  # noqa: E402
+import torch.multiprocessing as mp  # noqa: E402
+import torch.nn as nn  # noqa: E402
+from torch.nn.parallel import DistributedDataParallel  # noqa: E402
+
+from wandb_example import (  # noqa: E402
+    MLP,
+    get_batched_dataloaders,
+    get_dataloaders,
+    set_sampler_epoch,
+)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def synthetic_data(samples):
+    """Random (images, labels) with the shapes of MNIST."""
+    generator = torch.Generator().manual_seed(0)
+    images = torch.rand(samples, 1, 28, 28, generator=generator)
+    labels = torch.randint(0, 10, (samples,), generator=generator)
+    return images, labels
+
+
+def run(rank, world_size, args, port, results):
+    os.environ.update(MASTER_ADDR="127.0.0.1", MASTER_PORT=str(port))
+    torch.set_num_threads(max(1, args.cpus // world_size))
+    # also with a single process, so that all the runs shard the same way
+    dist.init_process_group("gloo", rank=rank, world_size=world_size)
+
+    if args.synthetic:
+        train_loader, _, _ = get_batched_dataloaders(
+            args.batch_size, synthetic_data(60000), synthetic_data(10000)
+        )
+    else:
+        train_loader, _, _ = get_dataloaders(
+            args.batch_size, data_mode="tensor", data_dir=args.data_dir
+        )
+    model = DistributedDataParallel(MLP(args.hidden_size))
+    optimizer = torch.optim.Adam(model.parameters(), lr=0.001)
+    loss_fn = nn.CrossEntropyLoss()
+
+    epochs = []
+    for epoch in range(args.epochs + 1):
+        set_sampler_epoch(train_loader, epoch)
+        dist.barrier()
+        start = time.perf_counter()
+        samples = 0
+        for images, labels in train_loader:
+            optimizer.zero_grad()
+            loss = loss_fn(model(images), labels)
+            loss.backward()
+            optimizer.step()
+            samples += labels.size(0)
+        dist.barrier()
+        epochs.append(time.perf_counter() - start)
+
+    if rank == 0:
+        # the first epoch warms up the allocator and the gloo connections
+        results.put((min(epochs[1:]), samples * world_size))
+    dist.destroy_process_group()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--epochs", type=int, default=2, help="timed epochs")
+    parser.add_argument("--batch_size", type=int, default=128, help="per process")
+    parser.add_argument("--hidden_size", type=int, default=100)
+    parser.add_argument("--data_dir", default="./data")
+    parser.add_argument(
+        "--synthetic", action="store_true", help="random data instead of MNIST"
+    )
+    parser.add_argument(
+        "--cpus", type=int, default=len(os.sched_getaffinity(0)), help="CPUs shared"
+    )
+    args = parser.parse_args()
+
+    if not args.synthetic:
+        # decoded once before the processes read it
+        get_dataloaders(args.batch_size, data_mode="tensor", data_dir=args.data_dir)
+
+    context = mp.get_context("spawn")
+    baseline = None
+    for world_size in args.processes:
+        results = context.SimpleQueue()
+        mp.spawn(run, args=(world_size, args, free_port(), results), nprocs=world_size)
+        seconds, samples = results.get()
+        if baseline is None:
+            # single process time, extrapolated if it is not measured
+            baseline = seconds * world_size
+        speedup = baseline / seconds
+        print(
+            f"{world_size:>2} processes  epoch {seconds:6.2f} s   "
+            f"{samples / seconds:>10,.0f} samples/s   speedup x{speedup:.2f}   "
+            f"efficiency {100 * speedup / world_size:5.1f}%"
+        )
+
+
+if __name__ == "__main__":
+    main()
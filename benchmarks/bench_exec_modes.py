@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Correctness and throughput of the wandb_example execution modes on CPU.
+
+Each --exec_mode of wandb_example (eager fp32, torch.compile, bf16 autocast)
+starts from the same initial MLP. Its predictions on a fixed batch are
+compared to the eager fp32 ones (max difference of the probabilities, within
+a tolerance per mode, the exit status is 1 otherwise), then the training steps
+and the evaluation (with the larger --eval_batch_size) are timed on in-memory
+batches of the same shape.
+
+    python benchmarks/bench_exec_modes.py --steps 200 --threads 8
+"""
+
+import argparse
+import copy
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import torch  # noqa: E402
+import torch.nn as nn  # noqa: E402
+
+from wandb_example import (  # noqa: E402
+    EXEC_MODES,
+    MLP,
+    load_mnist_tensors,
+    make_forward_loss,
+)
+
+# max difference of the predicted probabilities with eager fp32
+TOLERANCES = {"eager": 0, "compile": 1e-4, "bf16": 2e-2, "compile_bf16": 2e-2}
+
+
+def get_data(args):
+    if args.synthetic:
+        generator = torch.Generator().manual_seed(0)
+        images = torch.rand(60000, 1, 28, 28, generator=generator)
+        labels = torch.randint(0, 10, (60000,), generator=generator)
+    else:
+        images, labels = load_mnist_tensors(args.data_dir, train=True)
+    # in memory, only the compute is timed
+    return images.clone(), labels.clone()
+
+
+def full_batches(images, labels, batch_size):
+    """
+    The batches of batch_size samples, without the last partial one: its new
+    shape would recompile the compiled modes within the timed loop.
+    """
+    return [
+        batch
+        for batch in zip(images.split(batch_size), labels.split(batch_size))
+        if batch[1].size(0) == batch_size
+    ]
+
+
+def check_outputs(forward_loss, reference, images, labels):
+    """Max difference of the probabilities with the reference ones."""
+    with torch.no_grad():
+        outputs, _ = forward_loss(images, labels)
+    return (outputs.float().softmax(1) - reference).abs().max().item()
+
+
+def time_training(model, forward_loss, batches, warmup):
+    """Returns (samples/s, last loss) of the training steps after warmup."""
+    optimizer = torch.optim.Adam(model.parameters(), lr=0.001)
+    samples = 0
+    for i, (images, labels) in enumerate(batches):
+        if i == warmup:
+            start = time.perf_counter()
+            samples = 0
+        optimizer.zero_grad()
+        _, loss = forward_loss(images, labels)
+        loss.backward()
+        optimizer.step()
+        samples += labels.size(0)
+    return samples / (time.perf_counter() - start), loss.item()
+
+
+def time_evaluation(forward_loss, batches, warmup):
+    """Returns the samples/s of the evaluation after warmup batches."""
+    with torch.no_grad():
+        for images, labels in batches[:warmup]:
+            forward_loss(images, labels)
+        start = time.perf_counter()
+        for images, labels in batches[warmup:]:
+            forward_loss(images, labels)
+    samples = sum(labels.size(0) for _, labels in batches[warmup:])
+    return samples / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--modes", nargs="+", choices=EXEC_MODES, default=EXEC_MODES)
+    parser.add_argument("--steps", type=int, default=200, help="timed steps")
+    parser.add_argument(
+        "--warmup", type=int, default=20, help="untimed steps (compilation)"
+    )
+    parser.add_argument("--batch_size", type=int, default=128)
+    parser.add_argument("--eval_batch_size", type=int, default=1024)
+    parser.add_argument("--hidden_size", type=int, default=100)
+    parser.add_argument("--threads", type=int, default=torch.get_num_threads())
+    parser.add_argument("--data_dir", default="./data")
+    parser.add_argument(
+        "--synthetic", action="store_true", help="random data instead of MNIST"
+    )
+    args = parser.parse_args()
+    torch.set_num_threads(args.threads)
+
+    images, labels = get_data(args)
+    train_batches = full_batches(images, labels, args.batch_size)
+    train_batches = train_batches[: args.warmup + args.steps]
+    eval_batches = full_batches(images, labels, args.eval_batch_size)
+
+    torch.manual_seed(0)
+    initial_model = MLP(args.hidden_size)
+    loss_fn = nn.CrossEntropyLoss()
+    check_images, check_labels = eval_batches[0]
+    with torch.no_grad():
+        reference = initial_model(check_images).softmax(1)
+
+    results = {}
+    mismatches = []
+    for mode in args.modes:
+        model = copy.deepcopy(initial_model)
+        forward_loss = make_forward_loss(model, loss_fn, mode, "cpu")
+        error = check_outputs(forward_loss, reference, check_images, check_labels)
+        status = "OK" if error <= TOLERANCES[mode] else "MISMATCH"
+        if status != "OK":
+            mismatches.append(mode)
+        train_speed, loss = time_training(
+            model, forward_loss, train_batches, args.warmup
+        )
+        eval_speed = time_evaluation(
+            forward_loss, eval_batches, min(args.warmup, len(eval_batches) // 2)
+        )
+        results[mode] = train_speed
+        print(
+            f"{mode:<13} max error {error:.1e} {status:<8}  "
+            f"train {train_speed:>10,.0f} samples/s (loss {loss:.3f})  "
+            f"eval {eval_speed:>10,.0f} samples/s"
+        )
+
+    baseline = results.get("eager")
+    if baseline:
+        for mode, speed in results.items():
+            print(f"{mode:<13} train speedup x{speed / baseline:.2f}")
+    if mismatches:
+        print(f"Outside of the tolerance: {', '.join(mismatches)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
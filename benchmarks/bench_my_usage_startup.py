@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark of my_usage_script.py on a login with a fresh cache.
+
+A cache is written in a temporary HOME, then the script is run several times
+with `python -X importtime`: the wall time of each run and the time spent in
+imports are reported, with the most expensive imports.
+
+    python benchmarks/bench_my_usage_startup.py --runs 20
+"""
+
+import argparse
+import importlib.util
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+SCRIPT_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "..",
+    "cluster_usage_scipts",
+    "my_usage_script.py",
+)
+TARGET_MS = 30
+
+
+def write_fresh_cache(home):
+    """Writes the cache files of my_usage_script in home, as a refresh would."""
+    os.environ["HOME"] = home
+    spec = importlib.util.spec_from_file_location("my_usage_script", SCRIPT_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    clusters = module.CLUSTERS
+    users = {
+        f"user{i:02d}": {cluster: 1000 * (i + 1) for cluster in clusters}
+        for i in range(module.DMML_HPC_USERS)
+    }
+    team = {
+        "pi": module.PI_NAME,
+        "budget": 5_000_000,
+        "budget_by_cluster": {cluster: 5_000_000 // 3 for cluster in clusters},
+        "budget_reported": 5_000_000,
+        "team_usage": sum(sum(usage.values()) for usage in users.values()),
+        "users": module.pack_users(users),
+        "max_pct": 100 // module.DMML_HPC_USERS,
+        "updated": datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
+        "version": module.CACHE_VERSION,
+    }
+    module.write_env(module.env_from_team(team, "user00"), "user00")
+
+
+def parse_importtime(stderr):
+    """
+    Returns the total import time and the top level imports sorted by their
+    cumulative time (in us).
+    """
+    total = 0
+    top_level = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        # import time: self [us] | cumulative | imported package
+        self_us, cumulative_us, package = line[len("import time:") :].split("|", 2)
+        total += int(self_us)
+        cumulative_us = int(cumulative_us)
+        # nested imports are indented below their parent
+        if not package.startswith("  "):
+            top_level.append((cumulative_us, package.strip()))
+    top_level.sort(reverse=True)
+    return total, top_level
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=20, help="number of runs")
+    parser.add_argument("--python", default=sys.executable, help="interpreter")
+    parser.add_argument("--top", type=int, default=5, help="imports to show")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as home:
+        write_fresh_cache(home)
+        env = dict(os.environ, HOME=home)
+
+        wall_ms, import_ms = [], []
+        top_level = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            result = subprocess.run(
+                [args.python, "-X", "importtime", SCRIPT_PATH],
+                env=env,
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+            wall_ms.append((time.perf_counter() - start) * 1000)
+            total_us, top_level = parse_importtime(result.stderr)
+            import_ms.append(total_us / 1000)
+
+        # reference: the interpreter alone
+        baseline_ms = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            subprocess.run([args.python, "-c", "pass"], env=env, check=True)
+            baseline_ms.append((time.perf_counter() - start) * 1000)
+
+    wall = statistics.median(wall_ms)
+    print(f"runs:                  {args.runs}")
+    print(f"python startup:        {statistics.median(baseline_ms):7.1f} ms")
+    print(f"my_usage_script:       {wall:7.1f} ms (min {min(wall_ms):.1f} ms)")
+    print(f"  of which imports:    {statistics.median(import_ms):7.1f} ms")
+    print(
+        f"target:                {TARGET_MS:7d} ms -> {'OK' if wall < TARGET_MS else 'SLOW'}"
+    )
+    print()
+    print(f"top {args.top} imports (cumulative):")
+    for cumulative_us, package in top_level[: args.top]:
+        print(f"  {cumulative_us / 1000:7.2f} ms  {package}")
+
+
+if __name__ == "__main__":
+    main()
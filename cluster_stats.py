@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+CPU and GPU usage of an account per year, per user (DETAILED) and in total
+(SUMMARY).
+
+Each (year, TRES) sreport query is issued once, concurrently, and both views
+are derived from the same results. The results of closed years cannot change
+anymore and are cached permanently.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "cluster_stats")
+WORKERS = 4  # concurrent sreport queries, keeps the load on slurmdbd bounded
+
+# TRES queried: (name in the report, sreport --tres or None for CPU, column of
+# the usage in the -P output)
+TRES = (
+    ("CPU", None, 4),
+    ("GPU", "gres/gpu", 5),
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--start-year", type=int, default=2019)
+    parser.add_argument("--end-year", type=int, default=2024)
+    parser.add_argument("--account", default="kalousis")
+    parser.add_argument("--user", default="", help="Only detail this user.")
+    parser.add_argument(
+        "--workers", type=int, default=WORKERS, help="Concurrent sreport queries."
+    )
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    return parser.parse_args()
+
+
+def run_sreport(account, year, tres):
+    command = [
+        "sreport",
+        "cluster",
+        "AccountUtilizationByUser",
+        f"account={account}",
+        f"start={year}-01-01",
+        f"end={year}-12-31",
+        "-t",
+        "hours",
+        "-nP",
+    ]
+    if tres:
+        command.append(f"--tres={tres}")
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(
+            f"sreport failed for {year} ({tres or 'cpu'}): {result.stderr.strip()}",
+            file=sys.stderr,
+        )
+        return None
+    return result.stdout
+
+
+def get_report(account, year, tres, cache_dir, today):
+    """
+    Returns the rows of the sreport output (lists of columns), from the cache
+    for the closed years.
+    """
+    closed = year < today.year
+    cache_path = os.path.join(
+        cache_dir, f"{account}_{year}_{(tres or 'cpu').replace('/', '_')}.txt"
+    )
+    output = None
+    if closed:
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                output = f.read()
+        except OSError:
+            pass
+    if output is None:
+        output = run_sreport(account, year, tres)
+        if output is None:
+            return []
+        if closed:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(output)
+            os.replace(tmp_path, cache_path)
+    return [line.split("|") for line in output.splitlines() if line.strip()]
+
+
+def get_reports(args, today):
+    """Returns {(year, tres name): rows} with one query per key, run concurrently."""
+    keys = [
+        (year, tres)
+        for year in range(args.start_year, args.end_year + 1)
+        for tres in TRES
+    ]
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futures = {
+            (year, name): pool.submit(
+                get_report, args.account, year, tres, args.cache_dir, today
+            )
+            for year, (name, tres, _) in keys
+        }
+    return {key: future.result() for key, future in futures.items()}
+
+
+def print_detailed(args, reports):
+    print("DETAILED: CPU and GPU usage per year")
+    for year in range(args.start_year, args.end_year + 1):
+        if not any(reports[year, name] for name, _, _ in TRES):
+            continue
+        print(f"Year: {year}")
+        for name, _, column in TRES:
+            # the account total comes first, without login
+            rows = [row for row in reports[year, name] if row[2]]
+            if args.user:
+                rows = [row for row in rows if row[2] == args.user]
+            if reports[year, name]:
+                print(f"{name} Usage:")
+                for row in rows:
+                    print(
+                        f"({row[0]}) User: {row[2]} ({row[3]}) used {row[column]} "
+                        f"{name} hours"
+                    )
+            print()
+
+
+def print_summary(args, reports):
+    print(f"\n\nSUMMARY: CPU and GPU usage for ALL users in {args.account}")
+    for year in range(args.start_year, args.end_year + 1):
+        if not any(reports[year, name] for name, _, _ in TRES):
+            continue
+        print(f"Year: {year}")
+        for name, _, column in TRES:
+            for row in reports[year, name]:
+                if not row[2]:
+                    print(f"({row[0]}) {name} usage in {year} = {row[column]} hours")
+        print()
+
+
+def main():
+    args = parse_args()
+
+    print("Running report with the following parameters:")
+    print(f"Start Year: {args.start_year}")
+    print(f"End Year: {args.end_year}")
+    print(f"Account: {args.account}")
+    print(f"User: {args.user}" if args.user else "User: All users")
+    print("--------------------------------")
+    print()
+    print()
+
+    reports = get_reports(args, date.today())
+    print_detailed(args, reports)
+    print_summary(args, reports)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,451 @@
+#!/usr/bin/env python3
+"""
+Job listing and cancellation behind src, srj, my_squeue_gpu and my_scancel
+(my_cluster_cmds.sh).
+
+The queue of the user is read with a single squeue call in a parsable format
+and the times are parsed in the same pass, so selecting among thousands of
+jobs forks no process per job. The selected jobs are cancelled with a single
+scancel call.
+
+The listing is kept a few seconds in a per-user snapshot shared by all the
+helpers, so monitoring loops (watch src) query slurmctld at most once per TTL.
+"""
+
+import argparse
+import fcntl
+import getpass
+import json
+import os
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+# squeue fields, the job name last since it may contain the separator
+SQUEUE_FIELDS = (
+    ("id", "%i"),
+    ("partition", "%P"),
+    ("user", "%u"),
+    ("state", "%t"),
+    ("elapsed", "%M"),
+    ("remaining", "%L"),
+    ("limit", "%l"),
+    ("nodes", "%D"),
+    ("reason", "%R"),
+    ("name", "%j"),
+)
+SQUEUE_SEPARATOR = "|"
+SQUEUE_FORMAT = SQUEUE_SEPARATOR.join(fmt for _, fmt in SQUEUE_FIELDS)
+
+# snapshot of the squeue listing, private to the user
+SNAPSHOT_PATH = os.path.join(
+    os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir(),
+    f"my_jobs_squeue_{getpass.getuser()}.json",
+)
+SNAPSHOT_TTL = float(os.environ.get("MY_JOBS_SNAPSHOT_TTL", 5))  # seconds
+SNAPSHOT_VERSION = 1
+
+# columns of my_squeue: (header, field, width), no width for the last one
+LIST_COLUMNS = (
+    ("JOBID", "id", 10),
+    ("PARTITION", "partition", 20),
+    ("NAME", "name", 50),
+    ("USER", "user", 10),
+    ("ST", "state", 2),
+    ("TIME", "elapsed", 10),
+    ("NODES", "nodes", 4),
+    ("NODELIST(REASON)", "reason", None),
+)
+
+DURATION_RE = re.compile(
+    r"(\d+)(d|day|days|h|hour|hours|m|min|minute|minutes|s|sec|second|seconds|secondes)"
+)
+UNIT_SECONDS = {"d": 24 * 60 * 60, "h": 60 * 60, "m": 60, "s": 1}
+
+CANCEL_WAIT = 10  # seconds, default of my_scancel --wait
+# polling of the cancelled jobs, doubled after each poll up to the maximum
+POLL_DELAY = 0.25  # seconds
+POLL_MAX_DELAY = 4  # seconds
+# states of a job still in the queue (squeue -j also lists ended jobs)
+QUEUED_STATES = "PD,R,S,CG,CF"
+
+SCANCEL_HELP = """\
+Usage: my_scancel [option...]
+   -h, --help             Show this help message
+   -p, --pattern [text]   Pattern to match using grep (cancels all jobs that match this pattern)
+   -ip, --inverse_pattern Invert the pattern, so now the command will KEEP jobs that match the pattern
+   -t, --time [time]      Stop jobs with execution time greater than this value (d-hh:mm:ss, hh:mm:ss, mm:ss, s or #d, #h, #m)
+   -it, --inverse_time    Stop jobs with remaining time greater than the time passed with --time
+   -nd, --no_dryrun       Don't show jobs in dry run mode (dangerous)
+   -w, --wait [seconds]   Wait at most this long for the jobs to leave the queue (default: 10, 0 to not wait)
+
+Description:
+   This fundtion provides a flexible way to cancel jobs on a cluster based on different criteria.
+   Use the options to specify patterns, time limits, and dry run behavior.
+
+Examples:
+   1. Cancel all jobs that contain the pattern 'experiment':
+      my_scancel -p experiment
+
+   2. Cancel all jobs that DON'T contain the pattern 'experiment':
+      my_scancel -p experiment -ip
+
+   3. Cancel jobs with execution time exceeding 1 hour:
+      my_scancel -t 01:00:00
+      my_scancel -t 1h
+
+   4. Cancel jobs with remaining time exceeding than 2 days:
+      my_scancel -t 2-00:00:00 -it
+      my_scancel -t 2d -it
+
+   5. Cancel all jobs:
+      5.1 with a dry run preview:
+          my_scancel
+      5.2 without displaying a dry run preview:
+          my_scancel -nd
+
+   6. It is possible to cancel jobs with pattern and time constrain:
+      my_scancel -p pattern -t 2d
+      my_scancel -p pattern -ip -t 2d -it"""
+
+
+def parse_slurm_time(text):
+    """
+    Returns the seconds of a squeue time ([days-][hours:]minutes:seconds), or
+    None for times without a value (UNLIMITED, NOT_SET, INVALID).
+    """
+    days, _, clock = text.rpartition("-")
+    seconds = 0
+    try:
+        for part in clock.split(":"):
+            seconds = seconds * 60 + int(part)
+        return seconds + int(days or 0) * UNIT_SECONDS["d"]
+    except ValueError:
+        return None
+
+
+def parse_duration(text):
+    """Parses the --time of my_scancel: a squeue time, seconds or #d, #h, #m, #s."""
+    match = DURATION_RE.fullmatch(text)
+    if match:
+        return int(match[1]) * UNIT_SECONDS[match[2][0]]
+    seconds = parse_slurm_time(text)
+    if seconds is None:
+        raise argparse.ArgumentTypeError(f"invalid time: {text}")
+    return seconds
+
+
+def query_jobs(user):
+    """
+    Returns the jobs of the user from a single squeue call, sorted like
+    _squeue_helper, with their elapsed and remaining times in seconds.
+    """
+    output = subprocess.run(
+        ["squeue", "-h", "-u", user, "--sort=t,-S", "-o", SQUEUE_FORMAT],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    names = [name for name, _ in SQUEUE_FIELDS]
+    jobs = []
+    for line in output.splitlines():
+        values = line.split(SQUEUE_SEPARATOR, len(names) - 1)
+        if len(values) != len(names):
+            continue
+        job = dict(zip(names, values))
+        job["elapsed_s"] = parse_slurm_time(job["elapsed"])
+        job["remaining_s"] = parse_slurm_time(job["remaining"])
+        jobs.append(job)
+    return jobs
+
+
+def read_snapshot(user, max_age):
+    """Returns the jobs of the snapshot if it is younger than max_age seconds."""
+    try:
+        with open(SNAPSHOT_PATH, "r", encoding="utf-8") as f:
+            # in a shared /tmp, only trust a snapshot written by the user
+            if os.fstat(f.fileno()).st_uid != os.getuid():
+                return None
+            doc = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if doc.get("version") != SNAPSHOT_VERSION or doc.get("user") != user:
+        return None
+    if not 0 <= time.time() - doc["time"] <= max_age:
+        return None
+    return doc["jobs"]
+
+
+def write_snapshot(user, jobs, now):
+    doc = {"version": SNAPSHOT_VERSION, "user": user, "time": now, "jobs": jobs}
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(SNAPSHOT_PATH), prefix=".my_jobs_squeue."
+    )
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(doc, f, separators=(",", ":"))
+        os.replace(tmp_path, SNAPSHOT_PATH)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def invalidate_snapshot():
+    try:
+        os.remove(SNAPSHOT_PATH)
+    except OSError:
+        pass
+
+
+def open_lock(path):
+    """
+    Opens the lock file, created private to the user. Returns None if it is
+    not the user's: in a shared /tmp, a lock held by someone else would block
+    the helpers forever.
+    """
+    flags = os.O_RDWR | os.O_NOFOLLOW
+    try:
+        fd = os.open(path, flags | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        try:
+            fd = os.open(path, flags)
+        except OSError:
+            return None
+        if os.fstat(fd).st_uid != os.getuid():
+            os.close(fd)
+            return None
+    except OSError:
+        return None
+    return os.fdopen(fd, "r+")
+
+
+def get_jobs(user, max_age=SNAPSHOT_TTL):
+    """
+    Returns the jobs of the user from the snapshot, refreshed with a single
+    squeue call when it is older than max_age seconds.
+    """
+    jobs = read_snapshot(user, max_age)
+    if jobs is not None:
+        return jobs
+    lock = open_lock(SNAPSHOT_PATH + ".lock")
+    if lock is None:
+        return query_jobs(user)
+    with lock:
+        # helpers started together wait for a single refresh
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        jobs = read_snapshot(user, max_age)
+        if jobs is None:
+            now = time.time()
+            jobs = query_jobs(user)
+            try:
+                write_snapshot(user, jobs, now)
+            except OSError:
+                pass
+    return jobs
+
+
+def format_columns(values):
+    return " ".join(
+        f"{value:>{width}.{width}}" if width else value
+        for (_, _, width), value in zip(LIST_COLUMNS, values)
+    )
+
+
+def format_job(job):
+    """The line printed by _squeue_helper for the job, matched by --pattern."""
+    return (
+        f"{job['id']:>8.8} {job['name']:<150.150} {job['user']:>13.13} "
+        f"{job['elapsed']:>11.11} {job['remaining']:>11.11} {job['limit']:>11.11} "
+        f"{job['state']:>2.2}"
+    )
+
+
+def select_jobs(
+    jobs, pattern=None, inverse_pattern=False, min_time=None, inverse_time=False
+):
+    """
+    Returns the jobs matching pattern (or not, with inverse_pattern) and, if
+    min_time is given, the running ones with an elapsed (or remaining, with
+    inverse_time) time greater than min_time seconds.
+    """
+    regex = re.compile(pattern) if pattern else None
+    selected = []
+    for job in jobs:
+        if regex is not None and bool(regex.search(format_job(job))) == inverse_pattern:
+            continue
+        if min_time is not None:
+            seconds = job["remaining_s"] if inverse_time else job["elapsed_s"]
+            if job["state"] != "R" or seconds is None or seconds <= min_time:
+                continue
+        selected.append(job)
+    return selected
+
+
+def ask_permission(n_jobs_to_cancel, n_total):
+    print(f"If you continue you will cancel {n_jobs_to_cancel}/{n_total} jobs...")
+    try:
+        reply = input("Do you still want to continue? [y/n]? ")
+    except EOFError:
+        return False
+    return reply in ("y", "Y")
+
+
+def count_queued(job_ids):
+    """Returns how many of job_ids are still in the queue."""
+    # pending array tasks (123_[4-10]) are queried through their array job
+    query_ids = sorted({job_id.split("_[")[0] for job_id in job_ids})
+    result = subprocess.run(
+        ["squeue", "-h", "-j", ",".join(query_ids), "-t", QUEUED_STATES, "-o", "%i"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        # squeue fails when none of the jobs is known by the controller anymore
+        if "Invalid job id" in result.stderr:
+            return 0
+        raise subprocess.CalledProcessError(
+            result.returncode, result.args, result.stdout, result.stderr
+        )
+    return len(result.stdout.splitlines())
+
+
+def wait_for_jobs(job_ids, timeout=CANCEL_WAIT):
+    """
+    Waits until the jobs left the queue, polling only them with an exponential
+    backoff, and returns how many are still queued after timeout seconds.
+    """
+    deadline = time.monotonic() + timeout
+    delay = POLL_DELAY
+    n_queued = len(job_ids)
+    while True:
+        n = count_queued(job_ids)
+        if n != n_queued:
+            n_queued = n
+            print(f"  {len(job_ids) - n_queued}/{len(job_ids)} jobs left the queue")
+        if n_queued == 0:
+            return 0
+        now = time.monotonic()
+        if now >= deadline:
+            print("Timeout reached...")
+            return n_queued
+        time.sleep(min(delay, deadline - now))
+        delay = min(delay * 2, POLL_MAX_DELAY)
+
+
+def scancel(args, user):
+    jobs = get_jobs(user)
+    n_total = len(jobs)
+
+    if not args.all_args:
+        print("No arguments supplied, this command will cancel ALL your jobs!")
+        if ask_permission(n_total, n_total):
+            subprocess.run(["scancel", "-u", user])
+            invalidate_snapshot()
+        return 0
+
+    selected = select_jobs(
+        jobs, args.pattern, args.inverse_pattern, args.time, args.inverse_time
+    )
+    n_jobs_to_keep = n_total - len(selected)
+
+    if args.dryrun:
+        print(f"[DRYRUN] Number of jobs before cancel: {n_total}")
+        if args.inverse_pattern:
+            print(
+                "[DRYRUN][INVERSE] The following jobs are the ones that will REMAIN "
+                "all the other jobs will be canceled!!"
+            )
+            selected_ids = {job["id"] for job in selected}
+            shown = [job for job in jobs if job["id"] not in selected_ids]
+        else:
+            print("[DRYRUN] The following jobs are the ones that WILL be killed")
+            shown = selected
+        print()
+        for job in shown:
+            print(format_job(job))
+        print(f"[DRYRUN] Number of jobs after cancel: {n_jobs_to_keep}/{n_total}")
+    print()
+
+    if not selected:
+        print("No job to cancel.")
+        return 0
+    if not ask_permission(len(selected), n_total):
+        return 0
+
+    print()
+    print("Canceling jobs...")
+    job_ids = [job["id"] for job in selected]
+    subprocess.run(["scancel", *job_ids])
+    invalidate_snapshot()
+    if args.wait > 0:
+        print("Waiting a bit for jobs to cancel...")
+        n_queued = wait_for_jobs(job_ids, args.wait)
+        print(f"Number of jobs after cancel: {n_jobs_to_keep + n_queued}")
+    return 0
+
+
+def count(args, user):
+    jobs = get_jobs(user)
+    n_running = sum(job["state"] == "R" for job in jobs)
+    print(f"Jobs running: {n_running}/{len(jobs)}")
+    return 0
+
+
+def list_jobs(args, user):
+    regex = re.compile(args.match) if args.match else None
+    print(format_columns(header for header, _, _ in LIST_COLUMNS))
+    for job in get_jobs(user):
+        if args.state and job["state"] != args.state:
+            continue
+        line = format_columns(job[field] for _, field, _ in LIST_COLUMNS)
+        if regex is None or regex.search(line):
+            print(line)
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    # same flags and help as the former shell implementation of my_scancel
+    cancel = subparsers.add_parser("scancel", add_help=False)
+    cancel.add_argument("-h", "--help", action="store_true")
+    cancel.add_argument("-p", "--pattern")
+    cancel.add_argument("-ip", "--inverse_pattern", action="store_true")
+    cancel.add_argument("-t", "--time", type=parse_duration)
+    cancel.add_argument("-it", "--inverse_time", action="store_true")
+    cancel.add_argument("-nd", "--no_dryrun", dest="dryrun", action="store_false")
+    cancel.add_argument("-w", "--wait", type=float, default=CANCEL_WAIT)
+
+    subparsers.add_parser("count", help="Print the number of running/queued jobs.")
+
+    listing = subparsers.add_parser("list", help="List the jobs like my_squeue.")
+    listing.add_argument("--state", help="Only jobs in this state (ex: R).")
+    listing.add_argument("--match", help="Only jobs whose line matches this regex.")
+
+    argv = sys.argv[1:] if argv is None else argv
+    args = parser.parse_args(argv)
+    args.all_args = argv[1:]
+    return args
+
+
+def main():
+    # exit quietly when the output is piped to head
+    signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+    args = parse_args()
+    if args.command == "scancel" and args.help:
+        print(SCANCEL_HELP)
+        return 0
+    commands = {"scancel": scancel, "count": count, "list": list_jobs}
+    try:
+        return commands[args.command](args, getpass.getuser())
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"squeue failed: {e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
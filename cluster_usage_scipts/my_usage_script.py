@@ -1,17 +1,60 @@
 #!/usr/bin/env python3
+"""
+Prints the HPC usage of the user and of the team against the yearly budget.
+The UG scripts are imported directly from their location on the cluster so
+everything is computed in a single python process.
+"""
 
-import ast
-import getpass
 import os
-import re
-import subprocess
-from datetime import datetime, timedelta
+import sys
+import time
 
-# paths to external scripts just for reference
-# UG_SLURM_PARSE_ARGS_PATH = "/usr/local/bin/ug_slurm_parse_args.py"
-# UG_SLURM_USAGE_PATH = "/usr/local/bin/ug_slurm_usage_per_user.py"
-# UG_NODE_SUMMARY_PATH = "/usr/local/sbin/ug_getNodeCharacteristicsSummary.py"
-# SLURMPARTITIONS_PATH = "/usr/local/sbin/slurmpartitions.py"
+# Fast path: on login the cached report is usually fresh and only needs to be
+# printed. It is checked before the other imports so that case costs little
+# more than the interpreter startup (see benchmarks/bench_my_usage_startup.py).
+OUTPUT_REPORT_PATH = os.path.join(os.path.expanduser("~"), ".my_hpc_usage.report")
+VERBOSE = True
+UPDATE_INTERVALE = 10  # minutes, only runs on new login or reload of .bashrc
+
+
+def print_cached_report():
+    """
+    Prints the report rendered by the last refresh if it is still fresh.
+    The mtime of the report is the time of the data it shows.
+    """
+    if len(sys.argv) > 1:
+        return False
+    try:
+        if time.time() - os.stat(OUTPUT_REPORT_PATH).st_mtime > UPDATE_INTERVALE * 60:
+            return False
+        with open(OUTPUT_REPORT_PATH, "r", encoding="utf-8") as f:
+            report = f.read()
+    except OSError:
+        return False
+    if VERBOSE:
+        sys.stdout.write(report)
+    return True
+
+
+if __name__ == "__main__" and print_cached_report():
+    sys.exit(0)
+
+import argparse  # noqa: E402
+import contextlib  # noqa: E402
+import functools  # noqa: E402
+import getpass  # noqa: E402
+import importlib.util  # noqa: E402
+import io  # noqa: E402
+import json  # noqa: E402
+import types  # noqa: E402
+from concurrent.futures import ThreadPoolExecutor  # noqa: E402
+from datetime import date, datetime, timedelta  # noqa: E402
+
+UG_SLURM_PARSE_ARGS_PATH = "/usr/local/bin/ug_slurm_parse_args.py"
+UG_SLURM_USAGE_PATH = "/usr/local/bin/ug_slurm_usage_per_user.py"
+UG_NODE_SUMMARY_PATH = "/usr/local/sbin/ug_getNodeCharacteristicsSummary.py"
+SLURMPARTITIONS_PATH = "/usr/local/sbin/slurmpartitions.py"
+TABLERENDER_PATH = "/usr/local/bin/tablerender.py"
 
 REFERENCE_YEAR = datetime.today().year
 YEAR_START = f"{REFERENCE_YEAR}-01-01"
@@ -20,112 +63,249 @@ YEAR_END = f"{REFERENCE_YEAR+1}-01-01"
 PI_NAME = "kalousis"
 DEFAULT_PARTITION = "private-kalousis-gpu"
 CLUSTERS = ["baobab", "yggdrasil", "bamboo"]
-OUTPUT_ENV_PATH = os.path.join(os.path.expanduser("~"), ".my_hpc_usage.env")
+# cache read by this script (structured)
+CACHE_VERSION = 2
+OUTPUT_JSON_PATH = os.path.join(os.path.expanduser("~"), ".my_hpc_usage.json")
+# final segment shown in PS1 by update_usage_block in my_cluster_cmds.sh
+OUTPUT_PROMPT_PATH = os.path.join(os.path.expanduser("~"), ".my_hpc_usage.prompt")
+# files of the previous versions, removed on the next refresh: key=repr(value)
+# env file and the pre-formatted line replaced by the prompt file
+LEGACY_PATHS = [
+    os.path.join(os.path.expanduser("~"), ".my_hpc_usage.env"),
+    os.path.join(os.path.expanduser("~"), ".my_hpc_usage.shell"),
+]
+LOCK_PATH = os.path.join(os.path.expanduser("~"), ".my_hpc_usage.lock")
+REFRESH_LOG_PATH = os.path.join(os.path.expanduser("~"), ".my_hpc_usage.log")
+# group-readable directory where the team usage is computed once for all the
+# members (empty: every member queries slurm), see --shared-dir
+SHARED_CACHE_DIR = os.environ.get("MY_HPC_USAGE_SHARED_DIR", "")
+# team usage of this user when no shared directory is used
+TEAM_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "my_hpc_usage")
+# seconds given to sinfo/sreport, slower clusters keep their cached value
+REFRESH_DEADLINE = 60
 DMML_HPC_USERS = 13
-VERBOSE = True
-UPDATE_INTERVALE = 10  # minutes, only runs on new login or reload of .bashrc
+# the team of this script, other teams can be computed with --batch
+DEFAULT_TEAM = {
+    "pi": PI_NAME,
+    "partitions": [DEFAULT_PARTITION],
+    "headcount": DMML_HPC_USERS,
+}
+
+# burn-rate forecast (--forecast)
+DAILY_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "my_hpc_usage", "daily"
+)
+FORECAST_WINDOW = 30  # days used to compute the recent burn rate
+FORECAST_WORKERS = 8  # concurrent sreport calls for missing days
 
 
-def run_cmd(cmd):
+def load_module_from_path(name: str, path: str):
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Module path does not exist: {path}")
+    spec = importlib.util.spec_from_file_location(name, path)
+    if spec is None or spec.loader is None:
+        raise ImportError(f"Could not load spec for {name} from {path}")
+    module = importlib.util.module_from_spec(spec)
+    # register before executing so the other scripts can import it by name
+    sys.modules[name] = module
+    spec.loader.exec_module(module)  # type: ignore[attr-defined]
+    return module
+
+
+def ensure_pimanager_stub():
+    if "pimanager" in sys.modules:
+        return
+
+    class _StubPIManager:
+        def find_by_group(self, _):
+            return []
+
+    sys.modules["pimanager"] = types.SimpleNamespace(PIManager=_StubPIManager)
+
+
+@functools.lru_cache(maxsize=None)
+def load_modules():
     """
-    Run any command and return stdout as a string.
+    Imports the UG scripts and returns the classes used by this script.
     """
-    cmd_str = " ".join(cmd)
-    result = subprocess.run(
-        cmd_str,
-        shell=True,
-        check=True,
-        capture_output=True,
-        text=True,
-        executable="/bin/bash",
+    ensure_pimanager_stub()
+
+    # dependencies imported by name from the UG scripts
+    for name, path in (
+        ("slurmpartitions", SLURMPARTITIONS_PATH),
+        ("tablerender", TABLERENDER_PATH),
+        ("ug_slurm_parse_args", UG_SLURM_PARSE_ARGS_PATH),
+    ):
+        if name not in sys.modules and os.path.exists(path):
+            load_module_from_path(name, path)
+
+    usage_mod = load_module_from_path("ug_slurm_usage_per_user", UG_SLURM_USAGE_PATH)
+    node_mod = load_module_from_path(
+        "ug_getNodeCharacteristicsSummary", UG_NODE_SUMMARY_PATH
     )
-    return result.stdout
 
+    return types.SimpleNamespace(
+        NodeSet=node_mod.NodeSet,  # type: ignore[attr-defined]
+        Reporting=node_mod.Reporting,  # type: ignore[attr-defined]
+        SlurmPartition=node_mod.SlurmPartition,  # type: ignore[attr-defined]
+        UsagePerAccount=usage_mod.UsagePerAccount,  # type: ignore[attr-defined]
+    )
 
-def get_year_capacity():
-    cmd = [
-        "ug_getNodeCharacteristicsSummary.py",
-        "--summary",
-        "-p",
-        "private-kalousis-gpu",
-        "-c",
-    ]
 
-    total_cpuhours = 0
-    info = {}
+def read_inventory(inventory_path):
+    import yaml
 
-    for cluster in CLUSTERS:
-        cluster_cmd = cmd + [cluster]
-        output = run_cmd(cluster_cmd)
+    with open(inventory_path, "r") as f:
+        return yaml.safe_load(f)
 
-        match = re.search(r"CPUhours per year:\s*([\d.]+)M", output)
-        if match:
-            info[cluster] = int(float(match.group(1)) * 1_000_000)
-        else:
-            info[cluster] = 0
-        total_cpuhours += info[cluster]
 
-    # Extract reported total from summary (optional consistency check)
-    try:
-        output = run_cmd(cmd + ["{baobab,yggdrasil,bamboo}"])
-        summary_match = re.search(r"CPUhours per year:\s*([\d.]+)M", output)
-        if summary_match:
-            reported_total = int(float(summary_match.group(1)) * 1_000_000)
-        else:
-            reported_total = 0
-    except subprocess.CalledProcessError:
-        reported_total = 0
+def get_nodes_by_partition(modules, cluster, partitions):
+    """Nodes of each partition (dict[partition] -> NodeSet)."""
+    slurm_partition = modules.SlurmPartition(cluster, *partitions)
+    if hasattr(slurm_partition, "get_nodes_by_partition"):
+        # a single sinfo call
+        return slurm_partition.get_nodes_by_partition()
+    # installed slurmpartitions.py without it: one sinfo call per partition
+    return {
+        partition: modules.SlurmPartition(cluster, partition).get_nodes()
+        for partition in partitions
+    }
+
+
+def get_clusters_summaries(modules, cluster, teams):
+    """
+    Returns the summary (cpu, gpu, billing, cpuh_per_year...) of the partitions
+    of each team (dict[pi] -> summary) on the given cluster.
+    The partitions are listed once and the inventory is read once for all the
+    teams.
+    """
+    partitions = sorted({p for team in teams for p in team["partitions"]})
+    nodes_by_partition = get_nodes_by_partition(modules, cluster, partitions)
+    inventory_path = f"/opt/cluster/inventory/simplified_inventory_{cluster}.yaml"
+    inventory = read_inventory(inventory_path)
+
+    summaries = {}
+    for team in teams:
+        nodes = modules.NodeSet()
+        for partition in team["partitions"]:
+            nodes.update(nodes_by_partition.get(partition, modules.NodeSet()))
+        args = types.SimpleNamespace(
+            nodes=str(nodes),
+            partitions=None,
+            cluster=cluster,
+            summary=True,
+            format="pretty",
+            reference_year=datetime(REFERENCE_YEAR, 1, 1),
+        )
+        reporting = modules.Reporting(args, inventory_path)
+        # what read_yaml_inventory() sets, without reading the file per team
+        reporting._inventory = inventory
+        reporting.subset_filter()
+        summaries[team["pi"]] = reporting._compute()
+    return summaries
+
+
+def run_with_deadline(tasks, timeout):
+    """
+    Runs the callables of tasks (name -> callable) concurrently and waits for
+    them at most timeout seconds.
+    Returns the results of the calls that succeeded in time and the names of
+    the others. Daemon threads are used so a call stuck in slurm does not keep
+    the refresh alive after the deadline.
+    """
+    import threading
+
+    lock = threading.Lock()
+    results = {}
+
+    def run(name, func):
+        try:
+            result = func()
+        except Exception as exc:
+            print(f"- {name}: failed ({exc})")
+            return
+        with lock:
+            results[name] = result
+
+    threads = [
+        threading.Thread(target=run, args=(name, func), daemon=True)
+        for name, func in tasks.items()
+    ]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + timeout
+    for thread in threads:
+        thread.join(max(0, deadline - time.monotonic()))
+
+    with lock:
+        done = dict(results)
+    failed = [name for name in tasks if name not in done]
+    for name, thread in zip(tasks, threads):
+        if thread.is_alive():
+            print(f"- {name}: timed out after {timeout}s")
+    return done, failed
+
 
-    return total_cpuhours, info, reported_total
+def get_usage_rows(modules, user, start, end, pi_names=(PI_NAME,)):
+    """
+    Returns the sreport rows (one per cluster, account and login) of the teams.
+    """
+    usage = modules.UsagePerAccount()
+    return usage.get_user_usage_by_account(
+        user=user,
+        cluster=None,
+        pi_name=",".join(pi_names),
+        start=start,
+        end=end,
+        verbose=False,
+        time_format="Hours",
+        all_users=True,
+        aggregate=False,
+        report_type="user",
+    )
 
 
-def get_team_and_personal_usage(user):
+def get_teams_usage(modules, user, pi_names):
     """
-    Executes the kalousis usage command and returns:
+    Returns the usage of each team (dict[pi] -> tuple) with a single sreport:
         team_usage: total usage across all users
-        user_usage: usage for the given user login
         info: dict[cluster][login] -> used_hours
         users: dict[login][cluster] -> used_hours
     """
-    cmd = [
-        "ug_slurm_usage_per_user.py",
-        "--pi",
-        "kalousis",
-        "--all-users",
-        "--start",
-        YEAR_START,
-        "--end",
-        YEAR_END,
-    ]
+    rows = get_usage_rows(modules, user, YEAR_START, YEAR_END, pi_names)
+    if rows is None:
+        raise RuntimeError("sreport failed")
 
-    output = run_cmd(cmd)
+    rows_by_pi = {pi: [] for pi in pi_names}
+    for row in rows:
+        account = row.get("Account", "").strip().lower()
+        if account in rows_by_pi:
+            rows_by_pi[account].append(row)
 
-    info = {}  # cluster -> login -> usage
-    users = {}  # login -> cluster -> usage
-
-    for line in output.splitlines():
-        line = line.strip()
-        if (
-            not line
-            or line.startswith("----")
-            or line.startswith("Cluster/")
-            or line.startswith("Cluster")
-            or line.startswith("Usage reported")
-            or line.startswith("Total usage:")
-            or line.startswith("TRES")
-        ):
-            continue
+    usage = {}
+    for pi, pi_rows in rows_by_pi.items():
+        info, users = usage_from_rows(pi_rows)
+        team_total = sum(
+            used for cluster_dict in info.values() for used in cluster_dict.values()
+        )
+        usage[pi] = (team_total, info, users)
+    return usage
 
-        parts = line.split()
-        if len(parts) < 3:
-            continue
 
-        cluster = parts[0]
-        login = parts[1]
-        used_str = parts[-1]
+def usage_from_rows(rows):
+    """
+    Groups the sreport rows and returns:
+        info: dict[cluster][login] -> used_hours
+        users: dict[login][cluster] -> used_hours
+    """
+    info = {}  # cluster -> login -> usage
+    users = {}  # login -> cluster -> usage
 
+    for row in rows:
+        cluster = row.get("Cluster", "").strip()
+        login = row.get("Login", "").strip()
         try:
-            used = int(used_str.replace(",", ""))
+            used = int(row.get("Used", "0"))
         except ValueError:
             continue
 
@@ -137,39 +317,303 @@ def get_team_and_personal_usage(user):
         users.setdefault(login, {})
         users[login][cluster] = users[login].get(cluster, 0) + used
 
-    team_total = sum(
-        used for cluster_dict in info.values() for used in cluster_dict.values()
-    )
+    return info, users
 
-    user_total = sum(users.get(user, {}).values())
 
-    return team_total, user_total, info, users
+def get_daily_usage(modules, user, day):
+    """
+    Returns the usage of the team for a single day: dict[login][cluster] -> used_hours
+    or None if sreport failed.
+    """
+    end = day + timedelta(days=1)
+    rows = get_usage_rows(modules, user, day.isoformat(), end.isoformat())
+    if rows is None:
+        return None
+    _, users = usage_from_rows(rows)
+    return users
 
 
-def main():
-    user = getpass.getuser()
-    now_dt = datetime.now()
-    now = now_dt.strftime("%Y-%m-%dT%H:%M:%S")
+def load_daily_usage(modules, user, today):
+    """
+    Returns the list of days since the beginning of the year and the usage of
+    each day (see get_daily_usage), None for the days sreport failed on.
+    Closed days never change, they are cached on disk one file per day, so only
+    the days missing from the cache and today are fetched (concurrently).
+    """
+    year_start = date(today.year, 1, 1)
+    days = [
+        year_start + timedelta(days=i) for i in range((today - year_start).days + 1)
+    ]
+
+    daily = {}
+    missing = []
+    for day in days[:-1]:
+        path = os.path.join(DAILY_CACHE_DIR, f"{day.isoformat()}.json")
+        try:
+            with open(path, "r", encoding="ascii") as f:
+                daily[day] = json.load(f)
+        except (OSError, ValueError):
+            missing.append(day)
+    # today is still open, always fetch it
+    missing.append(today)
+
+    os.makedirs(DAILY_CACHE_DIR, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=FORECAST_WORKERS) as pool:
+        fetched = pool.map(lambda day: get_daily_usage(modules, user, day), missing)
+        for day, users in zip(missing, fetched):
+            daily[day] = users
+            # failed days are not cached so they are fetched again next time
+            if day < today and users is not None:
+                path = os.path.join(DAILY_CACHE_DIR, f"{day.isoformat()}.json")
+                write_atomic(path, json.dumps(users))
+
+    return days, [daily[day] for day in days]
+
 
-    env_data = {}
+def compute_forecast(days, daily_users, budget, max_pct, window=FORECAST_WINDOW):
+    """
+    Computes the burn rate and the projected exhaustion date of the team budget
+    and of the share of each user (max_pct % of the team budget).
+    The missing days (None) count as 0 in the usage and are left out of the
+    burn rate.
+    Returns a list of dict, the team is the first entry.
+    """
+    import numpy as np
+
+    logins = sorted({login for users in daily_users if users for login in users})
+    index = {login: i for i, login in enumerate(logins)}
+
+    # usage[user, day], the last row is the team
+    usage = np.zeros((len(logins) + 1, len(days)))
+    fetched = np.array([users is not None for users in daily_users])
+    for j, users in enumerate(daily_users):
+        for login, clusters in (users or {}).items():
+            usage[index[login], j] = sum(clusters.values())
+    usage[-1] = usage[:-1].sum(axis=0)
+
+    budgets = np.full(len(logins) + 1, budget * max_pct / 100)
+    budgets[-1] = budget
+
+    cumulative = usage.cumsum(axis=1)
+    used = cumulative[:, -1]
+
+    # burn rate on the last closed days (today is still running)
+    window_days = np.arange(len(days) - 1)[-window:]
+    closed = usage[:, window_days[fetched[window_days]]]
+    rate = closed.mean(axis=1) if closed.shape[1] else usage[:, -1]
+
+    remaining = budgets - used
+    with np.errstate(divide="ignore", invalid="ignore"):
+        days_left = np.where(rate > 0, remaining / rate, np.inf)
+    days_left = np.maximum(days_left, 0)
 
-    if os.path.exists(OUTPUT_ENV_PATH):
-        with open(OUTPUT_ENV_PATH, "r", encoding="ascii") as f:
-            existing_lines = f.readlines()
+    # day on which the budget was crossed, for budgets already exhausted
+    crossed = cumulative >= budgets[:, None]
+    first_crossed = np.where(crossed.any(axis=1), crossed.argmax(axis=1), -1)
 
-        env_data = {
-            key.strip(): value.strip()
-            for key, value in (
-                line.split("=", 1) for line in existing_lines if "=" in line
+    today = days[-1]
+    year_end = date(today.year, 12, 31)
+    days_to_year_end = (year_end - today).days
+    projected = used + rate * days_to_year_end
+    with np.errstate(divide="ignore", invalid="ignore"):
+        projected_pct = np.where(budgets > 0, projected / budgets * 100, 0)
+
+    forecast = []
+    for i, login in enumerate(["Team"] + logins):
+        row = i - 1 if i else -1
+        if first_crossed[row] >= 0:
+            exhaustion = days[first_crossed[row]]
+        elif np.isfinite(days_left[row]) and days_left[row] <= days_to_year_end:
+            exhaustion = today + timedelta(days=int(np.ceil(days_left[row])))
+        else:
+            exhaustion = None
+        forecast.append(
+            {
+                "login": login,
+                "used": int(used[row]),
+                "budget": int(budgets[row]),
+                "rate": float(rate[row]),
+                "projected_pct": float(projected_pct[row]),
+                "exhaustion": exhaustion,
+            }
+        )
+    return forecast
+
+
+def print_forecast(forecast, missing=(), window=FORECAST_WINDOW):
+    """
+    missing: the days sreport failed on, the forecast is then partial.
+    """
+    print(" Budget Forecast ".center(60, "-"))
+    print()
+    print(f"Burn rate computed on the last {window} closed days")
+    if missing:
+        print(
+            f"Partial: no usage for {len(missing)} days "
+            f"({', '.join(day.isoformat() for day in missing[:2])}"
+            f"{', ...' if len(missing) > 2 else ''}), retried on the next run."
+        )
+        print("They are left out of the rate, Used is a lower bound.")
+    print()
+    print(
+        f"{'':<12}{'Used':>12}{'Budget':>12}{'Rate/day':>10}{'Year end':>10}{'Exhausted':>12}"
+    )
+    for entry in forecast:
+        exhaustion = entry["exhaustion"].isoformat() if entry["exhaustion"] else "-"
+        print(
+            f"{entry['login']:<12}{entry['used']:>12_}{entry['budget']:>12_}"
+            f"{entry['rate']:>10_.0f}{entry['projected_pct']:>9.1f}%{exhaustion:>12}".replace(
+                "_", " "
             )
-        }
-        for key, value in env_data.items():
-            try:
-                env_data[key] = ast.literal_eval(value)
-            except (ValueError, SyntaxError):
-                pass
+        )
+    print()
+    print("=" * 60)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Show the HPC usage of the team against its yearly budget."
+    )
+    parser.add_argument(
+        "--forecast",
+        action="store_true",
+        help="Forecast the budget exhaustion date from the daily usage.",
+    )
+    parser.add_argument(
+        "--shared-dir",
+        default=SHARED_CACHE_DIR,
+        help="Group-readable directory holding the team usage shared by all members.",
+    )
+    parser.add_argument(
+        "--refresh-team",
+        action="store_true",
+        help="Only refresh the team usage in --shared-dir (ex: from a cron job).",
+    )
+    parser.add_argument(
+        "--batch",
+        metavar="CONFIG",
+        help="Refresh the usage of all the teams of a JSON config in one sweep "
+        "and write one cache per team in --shared-dir.",
+    )
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="Refresh the usage in the foreground instead of in the background.",
+    )
+    # used by the background refresh started at login
+    parser.add_argument("--refresh", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--lock-fd", type=int, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def write_atomic(path, text, mode=None):
+    """
+    Writes the file next to its final location and renames it, so readers never
+    see a partially written file.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="ascii") as f:
+        f.write(text)
+    if mode is not None:
+        os.chmod(tmp_path, mode)
+    os.replace(tmp_path, path)
+
+
+def make_shared_dir(path):
+    """
+    Creates the shared directory writable by the group, with the setgid bit so
+    its files belong to the group of the directory and not of their writer.
+    An existing directory is left as it is and must already be writable.
+    """
+    try:
+        os.makedirs(path)
+    except FileExistsError:
+        pass
+    else:
+        # the mode given to makedirs is masked by the umask
+        os.chmod(path, 0o2775)
+    if not os.access(path, os.W_OK | os.X_OK):
+        sys.exit(
+            f"The shared directory {path} is not writable by {getpass.getuser()}, "
+            f"its owner can fix it with: chmod 2775 {path} (and chgrp to the team)."
+        )
+
+
+def pack_users(users):
+    """
+    Stores dict[login][cluster] -> used_hours as one list of hours per login,
+    so the size of the cache grows with the number of users only.
+    """
+    clusters = sorted({cluster for usage in users.values() for cluster in usage})
+    return {
+        "clusters": clusters,
+        "usage": {
+            login: [usage.get(cluster, 0) for cluster in clusters]
+            for login, usage in users.items()
+        },
+    }
 
-    last_update_raw = env_data.get("LAST_HPC_USAGE_UPDATE")
+
+def unpack_users(packed):
+    clusters = packed["clusters"]
+    return {
+        login: {cluster: used for cluster, used in zip(clusters, usage) if used}
+        for login, usage in packed["usage"].items()
+    }
+
+
+def human_num(n):
+    # Under 100k -> show in k (1 decimal), 100k or more -> show in M (2 decimals)
+    if n < 100_000:
+        return f"{n / 1000:.1f}k"
+    return f"{n / 1_000_000:.2f}M"
+
+
+def read_env():
+    try:
+        with open(OUTPUT_JSON_PATH, "r", encoding="ascii") as f:
+            doc = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if doc.pop("version", None) != CACHE_VERSION:
+        return {}
+    doc["HPC_USERS_INFO"] = unpack_users(doc["HPC_USERS_INFO"])
+    return doc
+
+
+def write_env(env_data, user):
+    doc = dict(env_data, version=CACHE_VERSION)
+    doc["HPC_USERS_INFO"] = pack_users(env_data["HPC_USERS_INFO"])
+    write_atomic(OUTPUT_JSON_PATH, json.dumps(doc, separators=(",", ":")))
+
+    fields = [
+        human_num(env_data["HPC_MY_USAGE"]),
+        human_num(env_data["HPC_TEAM_USAGE"]),
+        human_num(env_data["HPC_TEAM_BUDGET_YEAR"]),
+    ]
+    # the shell reloads it when it was modified after its last read (test -N):
+    # the atime is set before the mtime so it shows as unread until then
+    write_atomic(OUTPUT_PROMPT_PATH, "/".join(fields) + "\n")
+    written = os.stat(OUTPUT_PROMPT_PATH).st_mtime
+    os.utime(OUTPUT_PROMPT_PATH, (written - 1, written))
+
+    # rendered once here so a login with a fresh cache only prints it
+    with contextlib.redirect_stdout(io.StringIO()) as report:
+        print_report(user, env_data)
+    write_atomic(OUTPUT_REPORT_PATH, report.getvalue())
+    data_time = 0
+    if env_data["LAST_HPC_USAGE_UPDATE"]:
+        data_time = datetime.fromisoformat(
+            env_data["LAST_HPC_USAGE_UPDATE"]
+        ).timestamp()
+    os.utime(OUTPUT_REPORT_PATH, (data_time, data_time))
+
+    for legacy_path in LEGACY_PATHS:
+        if os.path.exists(legacy_path):
+            os.remove(legacy_path)
+
+
+def is_stale(last_update_raw, now_dt):
     last_update_dt = None
     if last_update_raw:
         try:
@@ -177,27 +621,205 @@ def main():
         except ValueError:
             last_update_dt = None
 
-    update_needed = (
-        not env_data
-        or last_update_dt is None
-        or (now_dt - last_update_dt) > timedelta(minutes=UPDATE_INTERVALE)
+    return last_update_dt is None or (now_dt - last_update_dt) > timedelta(
+        minutes=UPDATE_INTERVALE
     )
 
-    if update_needed:
-        capacity_total, capacity_info, capacity_total_reported = get_year_capacity()
-        team_usage, my_usage, usage_info, users_info = get_team_and_personal_usage(user)
-        env_data = {
-            "HPC_MY_USAGE": my_usage,
-            "HPC_TEAM_USAGE": team_usage,
-            "HPC_TEAM_BUDGET_YEAR": capacity_total,
-            "HPC_TEAM_BUDGET_BY_CLUSTER": capacity_info,
-            "HPC_USERS_INFO": users_info,
-            "HPC_TEAM_BUDGET_YEAR_REPORTED": capacity_total_reported,
-            "HPC_MY_PCT": 0,
-            "HPC_TEAM_PCT": 0,
-            "HPC_MAX_PCT": 100 // DMML_HPC_USERS,
-            "LAST_HPC_USAGE_UPDATE": now,
+
+def is_update_needed(env_data, now_dt):
+    return not env_data or is_stale(env_data.get("LAST_HPC_USAGE_UPDATE"), now_dt)
+
+
+def collect_teams_data(teams, user, now, previous=None):
+    """
+    Queries slurm for the usage and the capacity of the teams in one sweep
+    and returns a document per team (dict[pi] -> team).
+    The capacity of each cluster and the usage are collected concurrently,
+    the ones not available before REFRESH_DEADLINE keep their previous value
+    (previous: dict[pi] -> team) and are listed in "stale", and "updated"
+    then keeps its previous value too (empty without a previous one).
+    """
+    modules = load_modules()
+    previous = previous or {}
+    pi_names = [team["pi"] for team in teams]
+
+    tasks = {
+        cluster: functools.partial(get_clusters_summaries, modules, cluster, teams)
+        for cluster in CLUSTERS
+    }
+    tasks["usage"] = functools.partial(get_teams_usage, modules, user, pi_names)
+    results, stale = run_with_deadline(tasks, REFRESH_DEADLINE)
+
+    documents = {}
+    for team in teams:
+        pi = team["pi"]
+        last = previous.get(pi) or {}
+
+        capacity_info = {}
+        reported_total = 0.0
+        for cluster in CLUSTERS:
+            if cluster in results:
+                cpuh = results[cluster][pi]["cpuh_per_year"]
+            else:
+                cpuh = last.get("budget_by_cluster", {}).get(cluster, 0)
+            capacity_info[cluster] = int(cpuh)
+            reported_total += cpuh
+
+        if "usage" in results:
+            team_usage, _, users_info = results["usage"][pi]
+            users = pack_users(users_info)
+        else:
+            team_usage = last.get("team_usage", 0)
+            users = last.get("users", pack_users({}))
+
+        documents[pi] = {
+            "pi": pi,
+            "partitions": team["partitions"],
+            "budget": sum(capacity_info.values()),
+            "budget_by_cluster": capacity_info,
+            # the summary over all clusters, without the per cluster rounding
+            "budget_reported": int(reported_total),
+            "team_usage": team_usage,
+            "users": users,
+            "max_pct": 100 // team["headcount"],
+            # the data is only as recent as its oldest part: with stale parts
+            # the previous time is kept, so the next login retries the refresh
+            "updated": last.get("updated", "") if stale else now,
+            "stale": stale,
+            "version": CACHE_VERSION,
         }
+    return documents
+
+
+def collect_team_data(user, now, previous=None):
+    """
+    Queries slurm for the usage and the capacity of the team of this script.
+    """
+    return collect_teams_data([DEFAULT_TEAM], user, now, {PI_NAME: previous})[PI_NAME]
+
+
+def read_teams_config(path):
+    """
+    Reads the teams of the batch mode, a JSON file like:
+        {"teams": [{"pi": "kalousis", "partitions": ["private-kalousis-gpu"],
+                    "headcount": 13}, ...]}
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    teams = []
+    for team in config["teams"]:
+        # the share of each member is 100 // headcount
+        try:
+            headcount = int(team.get("headcount", 1))
+        except (TypeError, ValueError):
+            headcount = 0
+        if headcount < 1:
+            print(
+                f"Skipping team {team['pi']} of {path}: invalid headcount "
+                f"{team.get('headcount')!r}, it must be at least 1."
+            )
+            continue
+        teams.append(
+            {
+                "pi": team["pi"].lower(),
+                "partitions": list(team.get("partitions", [])),
+                "headcount": headcount,
+            }
+        )
+    return teams
+
+
+def refresh_teams_batch(config_path, out_dir, user, now_dt):
+    """
+    Computes the capacity and usage of all the teams of the config in one
+    sweep and writes one team document per team in out_dir. Members of the
+    teams read them with --shared-dir.
+    """
+    teams = read_teams_config(config_path)
+    make_shared_dir(out_dir)
+    lock_fd = acquire_lock(os.path.join(out_dir, "batch.lock"), blocking=True)
+    try:
+        previous = {team["pi"]: read_team_cache(out_dir, team["pi"]) for team in teams}
+        documents = collect_teams_data(
+            teams, user, now_dt.strftime("%Y-%m-%dT%H:%M:%S"), previous
+        )
+        for pi, team in documents.items():
+            write_atomic(
+                get_team_cache_path(out_dir, pi),
+                json.dumps(team, separators=(",", ":")),
+                0o664,
+            )
+            print(f"{pi}: {get_team_cache_path(out_dir, pi)}")
+    finally:
+        os.close(lock_fd)
+
+
+def get_team_cache_path(team_dir, pi=PI_NAME):
+    return os.path.join(team_dir, f"team_{pi}.json")
+
+
+def read_team_cache(team_dir, pi=PI_NAME):
+    try:
+        with open(get_team_cache_path(team_dir, pi), "r", encoding="ascii") as f:
+            team = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return team if team.get("version") == CACHE_VERSION else None
+
+
+def load_team_data(team_dir, user, now_dt, force=False, mode=None):
+    """
+    Returns the team usage cached in team_dir, refreshed if it is stale.
+    In a shared directory, the first member to get the lock refreshes it for
+    everyone, the others wait and read the result.
+    """
+    team = read_team_cache(team_dir)
+    if not force and team and not is_stale(team.get("updated"), now_dt):
+        return team
+
+    if mode is None:
+        os.makedirs(team_dir, exist_ok=True)
+    else:
+        # the mode of the files is only given for a shared directory
+        make_shared_dir(team_dir)
+    lock_path = os.path.join(team_dir, f"team_{PI_NAME}.lock")
+    lock_fd = acquire_lock(lock_path, blocking=True)
+    try:
+        # another member may have refreshed it while we waited for the lock
+        team = read_team_cache(team_dir)
+        if force or not team or is_stale(team.get("updated"), now_dt):
+            team = collect_team_data(
+                user, now_dt.strftime("%Y-%m-%dT%H:%M:%S"), previous=team
+            )
+            write_atomic(
+                get_team_cache_path(team_dir),
+                json.dumps(team, separators=(",", ":")),
+                mode,
+            )
+    finally:
+        os.close(lock_fd)
+    return team
+
+
+def env_from_team(team, user):
+    """
+    Derives the env of the user from the usage of the team.
+    """
+    users_info = unpack_users(team["users"])
+    my_usage = sum(users_info.get(user, {}).values())
+    env_data = {
+        "HPC_MY_USAGE": my_usage,
+        "HPC_TEAM_USAGE": team["team_usage"],
+        "HPC_TEAM_BUDGET_YEAR": team["budget"],
+        "HPC_TEAM_BUDGET_BY_CLUSTER": team["budget_by_cluster"],
+        "HPC_USERS_INFO": users_info,
+        "HPC_TEAM_BUDGET_YEAR_REPORTED": team["budget_reported"],
+        "HPC_MY_PCT": 0,
+        "HPC_TEAM_PCT": 0,
+        "HPC_MAX_PCT": team["max_pct"],
+        "LAST_HPC_USAGE_UPDATE": team["updated"],
+        "HPC_STALE": team.get("stale", []),
+    }
 
     # Compute percentages
     capacity_value = float(env_data.get("HPC_TEAM_BUDGET_YEAR", 1) or 1)
@@ -206,83 +828,201 @@ def main():
     if capacity_value > 0:
         env_data["HPC_MY_PCT"] = round((my_usage_value / capacity_value) * 100, 2)
         env_data["HPC_TEAM_PCT"] = round((team_usage_value / capacity_value) * 100, 2)
+    return env_data
 
-    # Always write env file
 
-    with open(OUTPUT_ENV_PATH, "w", encoding="ascii") as f:
-        for key, value in env_data.items():
-            f.write(f"{key}={value}\n")
+def refresh_env(user, now_dt, shared_dir=""):
+    if shared_dir:
+        team = load_team_data(shared_dir, user, now_dt, mode=0o664)
+    else:
+        team = load_team_data(TEAM_CACHE_DIR, user, now_dt)
+    env_data = env_from_team(team, user)
+    write_env(env_data, user)
+    return env_data
 
-    if VERBOSE:
-        print()
-        print(" HPC Usage Report ".center(60, "="))
-        print()
-        print(f"User: {user}")
-        print(f"PI: {PI_NAME}")
-        print(f"Partitions: {DEFAULT_PARTITION}")
-        print()
-        print(
-            f"{'User usage':<25} {env_data["HPC_MY_USAGE"]:>15_} {env_data["HPC_MY_PCT"]:>17.2f}%".replace(
-                "_", " "
-            )
+
+def acquire_lock(path=LOCK_PATH, blocking=False):
+    """
+    Returns the fd holding the lock, or None if another refresh holds it.
+    """
+    import fcntl
+
+    # flock does not need write access, so any member of the group can lock
+    fd = os.open(path, os.O_RDONLY | os.O_CREAT, 0o664)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+
+def start_background_refresh(shared_dir=""):
+    """
+    Starts a detached refresh of the env file, unless one is already running.
+    The lock is taken here and inherited by the child: it is released when the
+    refresh exits, so concurrent logins start a single refresh.
+    """
+    import subprocess
+
+    fd = acquire_lock()
+    if fd is None:
+        return False
+    with open(REFRESH_LOG_PATH, "w", encoding="ascii") as log:
+        subprocess.Popen(
+            [
+                sys.executable,
+                os.path.abspath(__file__),
+                "--refresh",
+                "--lock-fd",
+                str(fd),
+                "--shared-dir",
+                shared_dir,
+            ],
+            pass_fds=(fd,),
+            stdin=subprocess.DEVNULL,
+            stdout=log,
+            stderr=log,
+            start_new_session=True,
         )
-        print(
-            f"{'Team usage':<25} {env_data["HPC_TEAM_USAGE"]:>15_} {env_data["HPC_TEAM_PCT"]:>17.2f}%".replace(
-                "_", " "
-            )
+    os.close(fd)
+    return True
+
+
+def print_report(user, env_data):
+    # values kept from the previous refresh because slurm did not answer in time
+    stale = env_data.get("HPC_STALE", [])
+    usage_mark = " *" if "usage" in stale else ""
+
+    print()
+    print(" HPC Usage Report ".center(60, "="))
+    print()
+    print(f"User: {user}")
+    print(f"PI: {PI_NAME}")
+    print(f"Partitions: {DEFAULT_PARTITION}")
+    print(f"Last update: {env_data.get('LAST_HPC_USAGE_UPDATE') or '-'}")
+    print()
+    print(
+        f"{'User usage':<25} {env_data['HPC_MY_USAGE']:>15_} {env_data['HPC_MY_PCT']:>17.2f}%{usage_mark}".replace(
+            "_", " "
         )
-        print(
-            f"{'Total budget':<25} {env_data["HPC_TEAM_BUDGET_YEAR"]:>15_} {100:>17.2f}%".replace(
-                "_", " "
-            )
+    )
+    print(
+        f"{'Team usage':<25} {env_data['HPC_TEAM_USAGE']:>15_} {env_data['HPC_TEAM_PCT']:>17.2f}%{usage_mark}".replace(
+            "_", " "
         )
-        print(
-            f"{'(Total budget rep)':<25} {env_data["HPC_TEAM_BUDGET_YEAR_REPORTED"]:>15_} {100:>17.2f}%".replace(
-                "_", " "
-            )
+    )
+    print(
+        f"{'Total budget':<25} {env_data['HPC_TEAM_BUDGET_YEAR']:>15_} {100:>17.2f}%".replace(
+            "_", " "
         )
+    )
+    print(
+        f"{'(Total budget rep)':<25} {env_data['HPC_TEAM_BUDGET_YEAR_REPORTED']:>15_} {100:>17.2f}%".replace(
+            "_", " "
+        )
+    )
+    print()
+    print(" Budget per Cluster ".center(60, "-"))
+    print()
+    clusters_line = f"{'':<11}"
+    budget_line = f"{'Budget':<11}"
+    for cluster, value in env_data.get("HPC_TEAM_BUDGET_BY_CLUSTER", {}).items():
+        clusters_line += f"{cluster + ('*' if cluster in stale else ''):>13}"
+        budget_line += f"{value:>13_}".replace("_", " ")
+
+    print(clusters_line)
+    print(budget_line)
+    print()
+    print(" Usage per User ".center(60, "-"))
+    print()
+
+    print(f"{'':<12}" + "".join(f"{cluster:>12}" for cluster in CLUSTERS + ["Total"]))
+
+    users_info = env_data.get("HPC_USERS_INFO", {})
+
+    # Sort users by total usage (descending)
+    sorted_users = sorted(
+        users_info.items(),
+        key=lambda item: sum(item[1].get(c, 0) for c in CLUSTERS),
+        reverse=True,
+    )
+
+    for user, usage_info in sorted_users:
+        usage_line = f"{user:<12}"
+
+        for cluster in CLUSTERS:
+            used = usage_info.get(cluster, 0)
+            usage_line += f"{used:>12_}".replace("_", " ")
+
+        total = sum(usage_info.get(c, 0) for c in CLUSTERS)
+        usage_line += f"{total:>12_}".replace("_", " ")
+
+        print(usage_line)
+
+    if stale:
         print()
-        print(" Budget per Cluster ".center(60, "-"))
-        print()
-        clusters_line = f"{'':<11}"
-        budget_line = f"{'Budget':<11}"
-        for cluster, value in env_data.get("HPC_TEAM_BUDGET_BY_CLUSTER", {}).items():
-            clusters_line += f"{cluster:>13}"
-            budget_line += f"{value:>13_}".replace("_", " ")
-
-        print(clusters_line)
-        print(budget_line)
-        print()
-        print(" Usage per User ".center(60, "-"))
-        print()
+        print(f"* stale ({', '.join(stale)}): value of the previous update")
+    print()
+    print("=" * 60)
 
-        print(
-            f"{'':<12}" + "".join(f"{cluster:>12}" for cluster in CLUSTERS + ["Total"])
-        )
 
-        users_info = env_data.get("HPC_USERS_INFO", {})
+def main():
+    args = parse_args()
+    user = getpass.getuser()
+    now_dt = datetime.now()
+
+    if args.refresh:
+        # background refresh: the lock is inherited from the login shell
+        lock_fd = args.lock_fd if args.lock_fd is not None else acquire_lock()
+        if lock_fd is None:
+            return
+        refresh_env(user, now_dt, args.shared_dir)
+        return
 
-        # Sort users by total usage (descending)
-        sorted_users = sorted(
-            users_info.items(),
-            key=lambda item: sum(item[1].get(c, 0) for c in CLUSTERS),
-            reverse=True,
+    if (args.refresh_team or args.batch) and not args.shared_dir:
+        print(
+            "--refresh-team and --batch need --shared-dir (or MY_HPC_USAGE_SHARED_DIR)."
         )
+        return
 
-        for user, usage_info in sorted_users:
-            usage_line = f"{user:<12}"
+    if args.batch:
+        refresh_teams_batch(args.batch, args.shared_dir, user, now_dt)
+        return
 
-            for cluster in CLUSTERS:
-                used = usage_info.get(cluster, 0)
-                usage_line += f"{used:>12_}".replace("_", " ")
+    if args.refresh_team:
+        load_team_data(args.shared_dir, user, now_dt, force=True, mode=0o664)
+        return
 
-            total = sum(usage_info.get(c, 0) for c in CLUSTERS)
-            usage_line += f"{total:>12_}".replace("_", " ")
+    env_data = read_env()
+    if is_update_needed(env_data, now_dt):
+        if args.sync or args.forecast:
+            lock_fd = acquire_lock(blocking=True)
+            # another refresh may have finished while we waited for the lock
+            env_data = read_env()
+            if is_update_needed(env_data, now_dt):
+                env_data = refresh_env(user, now_dt, args.shared_dir)
+            os.close(lock_fd)
+        elif start_background_refresh(args.shared_dir) and VERBOSE:
+            print("HPC usage is being refreshed in the background.")
 
-            print(usage_line)
+    if VERBOSE:
+        if env_data:
+            print_report(user, env_data)
+        else:
+            print("No HPC usage available yet, run again in a few minutes.")
 
-        print()
-        print("=" * 60)
+    if args.forecast:
+        modules = load_modules()
+        days, daily_users = load_daily_usage(modules, user, now_dt.date())
+        forecast = compute_forecast(
+            days,
+            daily_users,
+            budget=float(env_data.get("HPC_TEAM_BUDGET_YEAR", 0) or 0),
+            max_pct=float(env_data.get("HPC_MAX_PCT", 100) or 100),
+        )
+        missing = [day for day, users in zip(days, daily_users) if users is None]
+        print_forecast(forecast, missing)
 
 
 if __name__ == "__main__":
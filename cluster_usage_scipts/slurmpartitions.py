@@ -1,6 +1,6 @@
 import re
 import subprocess
-from typing import List
+from typing import Dict, List
 
 from ClusterShell.NodeSet import NodeSet
 
@@ -10,7 +10,7 @@ class SlurmPartition:
         self._partitions = partitions
         self._cluster = cluster
 
-    def run_sinfo(self) -> str:
+    def run_sinfo(self, output_format: str = "%N") -> str:
         try:
             result = subprocess.run(
                 [
@@ -21,7 +21,7 @@ class SlurmPartition:
                     "-p",
                     ",".join(self._partitions),
                     "-o",
-                    "%N",
+                    output_format,
                 ],
                 capture_output=True,
                 text=True,
@@ -35,6 +35,17 @@ class SlurmPartition:
     def get_nodes(self) -> NodeSet:
         return NodeSet(self.run_sinfo())
 
+    def get_nodes_by_partition(self) -> Dict[str, NodeSet]:
+        """Nodes of each partition, with a single sinfo call."""
+        nodes = {partition: NodeSet() for partition in self._partitions}
+        for line in self.run_sinfo("%R %N").splitlines():
+            fields = line.split()
+            if len(fields) != 2 or line.startswith("CLUSTER:"):
+                continue
+            partition, nodelist = fields
+            nodes.setdefault(partition, NodeSet()).update(nodelist)
+        return nodes
+
 
 def main():
     partition = SlurmPartition("baobab", "shared-gpu", "shared-cpu")
@@ -0,0 +1,237 @@
+"""
+Streaming table renderer used in place of tabulate for large reports.
+
+The output mimics tabulate's "simple" and "html" formats (numbers aligned on
+the decimal point, strings left aligned, headers at least 2 chars wider than
+their title) but the column types and widths are computed in a single pass
+over the rows and the lines are written as they are produced.
+"""
+
+import html
+import re
+import sys
+
+# column types, ordered like tabulate: a column takes the most generic type
+_NONE, _INT, _FLOAT, _STR = range(4)
+
+MIN_PADDING = 2
+
+# numbers with thousands separators, eg. 1,234.5 (the pattern of tabulate)
+_THOUSANDS_RE = re.compile(
+    r"^(([+-]?[0-9]{1,3})(?:,([0-9]{3}))*)?(?(1)\.[0-9]*|\.[0-9]+)?$"
+)
+
+
+def _strip_separators(value):
+    """The number without its thousands separators, other values unchanged."""
+    if isinstance(value, str) and "," in value and _THOUSANDS_RE.match(value.strip()):
+        return value.replace(",", "")
+    return value
+
+
+def _to_float(value):
+    return float(_strip_separators(value))
+
+
+def _cell_type(value):
+    if value is None:
+        return _NONE
+    if isinstance(value, bool):
+        return _STR
+    if isinstance(value, int):
+        return _INT
+    if isinstance(value, float):
+        return _FLOAT
+    value = _strip_separators(value)
+    try:
+        int(value)
+        return _INT
+    except (TypeError, ValueError):
+        pass
+    try:
+        float(value)
+        return _FLOAT
+    except (TypeError, ValueError):
+        return _STR
+
+
+def _afterpoint(text):
+    """Number of characters after the decimal point (-1 for integers)."""
+    pos = text.rfind(".")
+    if pos < 0:
+        pos = text.lower().rfind("e")
+    if pos < 0:
+        return -1
+    return len(text) - pos - 1
+
+
+def _sort_key(value):
+    try:
+        return (0, _to_float(value), "")
+    except (TypeError, ValueError):
+        return (1, 0.0, "" if value is None else str(value))
+
+
+def _normalize(rows, headers):
+    """Returns (headers, rows as lists)."""
+    if headers == "keys":
+        keys = {}
+        for row in rows:
+            for key in row:
+                keys.setdefault(key, None)
+        headers = list(keys)
+        return headers, [[row.get(key) for key in headers] for row in rows]
+    headers = list(headers or [])
+    if rows and isinstance(rows[0], dict):
+        return headers, [[row.get(key) for key in headers] for row in rows]
+    return headers, [list(row) for row in rows]
+
+
+def _select(headers, rows, sort=None, reverse=False, limit=None):
+    if sort is not None:
+        column = headers.index(sort) if sort in headers else int(sort)
+        rows = sorted(rows, key=lambda row: _sort_key(row[column]), reverse=reverse)
+    if limit is not None:
+        rows = rows[:limit]
+    return rows
+
+
+class _Columns:
+    """Types and widths of the columns, computed in one pass over the rows."""
+
+    def __init__(self, headers, rows):
+        ncols = max([len(headers)] + [len(row) for row in rows])
+        self.has_headers = bool(headers)
+        self.headers = headers + [""] * (ncols - len(headers))
+        self.types = [_NONE] * ncols
+        self.raw_widths = [0] * ncols
+        # decimal alignment of the float representation of numbers
+        self.decimals = [-1] * ncols
+        self.int_widths = [0] * ncols
+
+        for row in rows:
+            for i, value in enumerate(row):
+                cell_type = _cell_type(value)
+                if cell_type > self.types[i]:
+                    self.types[i] = cell_type
+                if cell_type == _NONE:
+                    continue
+                raw = str(value).strip()
+                if len(raw) > self.raw_widths[i]:
+                    self.raw_widths[i] = len(raw)
+                if cell_type in (_INT, _FLOAT):
+                    text = format(_to_float(value), "g")
+                    decimals = _afterpoint(text)
+                    if decimals > self.decimals[i]:
+                        self.decimals[i] = decimals
+                    if len(text) - decimals > self.int_widths[i]:
+                        self.int_widths[i] = len(text) - decimals
+
+        self.widths = []
+        for i, header in enumerate(self.headers):
+            if self.types[i] == _FLOAT:
+                width = self.int_widths[i] + self.decimals[i]
+            else:
+                width = self.raw_widths[i]
+            if self.has_headers:
+                width = max(width, len(header) + MIN_PADDING)
+            self.widths.append(width)
+
+    def numeric(self, i):
+        return self.types[i] in (_INT, _FLOAT)
+
+    def format_cell(self, i, value):
+        if value is None:
+            text = ""
+        elif self.types[i] == _FLOAT and _cell_type(value) in (_INT, _FLOAT):
+            text = format(_to_float(value), "g")
+            text += " " * (self.decimals[i] - _afterpoint(text))
+        else:
+            text = str(value).strip()
+        if self.numeric(i):
+            return text.rjust(self.widths[i])
+        return text.ljust(self.widths[i])
+
+    def format_header(self, i):
+        if self.numeric(i):
+            return self.headers[i].rjust(self.widths[i])
+        return self.headers[i].ljust(self.widths[i])
+
+    def cells(self, row):
+        row = list(row) + [None] * (len(self.widths) - len(row))
+        return [self.format_cell(i, value) for i, value in enumerate(row)]
+
+
+def _simple_lines(columns, rows, page_size=None):
+    def join(cells):
+        return "  ".join(cells).rstrip()
+
+    header = join(columns.format_header(i) for i in range(len(columns.widths)))
+    separator = join("-" * width for width in columns.widths)
+    if not columns.has_headers:
+        yield separator
+        for row in rows:
+            yield join(columns.cells(row))
+        yield separator
+        return
+    for n, row in enumerate(rows):
+        if n == 0 or (page_size and n % page_size == 0):
+            if n:
+                yield ""
+            yield header
+            yield separator
+        yield join(columns.cells(row))
+    if not rows:
+        yield header
+        yield separator
+
+
+def _html_lines(columns, rows):
+    def attrs(i):
+        return ' style="text-align: right;"' if columns.numeric(i) else ""
+
+    yield "<table>"
+    yield "<thead>"
+    yield "<tr>" + "".join(
+        f"<th{attrs(i)}>{html.escape(columns.format_header(i))}</th>"
+        for i in range(len(columns.widths))
+    ) + "</tr>"
+    yield "</thead>"
+    yield "<tbody>"
+    for row in rows:
+        yield "<tr>" + "".join(
+            f"<td{attrs(i)}>{html.escape(cell)}</td>"
+            for i, cell in enumerate(columns.cells(row))
+        ) + "</tr>"
+    yield "</tbody>"
+    yield "</table>"
+
+
+def render_table(
+    rows,
+    headers=(),
+    tablefmt="simple",
+    sort=None,
+    reverse=False,
+    limit=None,
+    page_size=None,
+    file=None,
+):
+    """
+    Writes rows (list of lists, or list of dicts with headers="keys") as a table.
+
+    :param sort: header name (or column index) used to sort the rows
+    :param reverse: sort in descending order
+    :param limit: only print the first rows (after sorting)
+    :param page_size: repeat the header every page_size rows ("simple" only)
+    """
+    file = file or sys.stdout
+    headers, rows = _normalize(rows, headers)
+    rows = _select(headers, rows, sort, reverse, limit)
+    columns = _Columns(headers, rows)
+    if tablefmt == "html":
+        lines = _html_lines(columns, rows)
+    else:
+        lines = _simple_lines(columns, rows, page_size)
+    for line in lines:
+        file.write(line + "\n")
@@ -18,11 +18,11 @@ try:
     from ClusterShell.NodeSet import NodeSet
     from dateutil.relativedelta import relativedelta
     from slurmpartitions import SlurmPartition
-    from tabulate import tabulate
+    from tablerender import render_table
 except ModuleNotFoundError as e:
     print(f"Missing module {e}")
     print(
-        "Please load tabulate and ClusterShell module. Ex: module load GCCcore/13.3.0 ClusterShell/1.9.3 tabulate2/1.10.0"
+        "Please load ClusterShell module. Ex: module load GCCcore/13.3.0 ClusterShell/1.9.3"
     )
     exit(1)
 
@@ -72,6 +72,20 @@ def parseArgs():
         required=False,  # Optionnel
         help="Output format : 'csv', 'html', 'pretty' (default)",
     )
+    parser.add_argument(
+        "--sort", help="Sort the resource list by this column (ex: billing)"
+    )
+    parser.add_argument(
+        "--reverse", action="store_true", help="Sort in descending order"
+    )
+    parser.add_argument(
+        "--limit", type=int, help="Only print the first LIMIT nodes of the list"
+    )
+    parser.add_argument(
+        "--page-size",
+        type=int,
+        help="Repeat the header of the resource list every PAGE_SIZE nodes",
+    )
     return parser.parse_args()
 
 
@@ -96,6 +110,11 @@ class Reporting:
         self._inventory = None
         self._subset = None
         self._nodes_parsed = []
+        # options of the resource list (not set when used as a library)
+        self._sort = getattr(args, "sort", None)
+        self._reverse = getattr(args, "reverse", False)
+        self._limit = getattr(args, "limit", None)
+        self._page_size = getattr(args, "page_size", None)
 
     def read_yaml_inventory(self):
         # Read the yaml inventory file
@@ -127,11 +146,25 @@ class Reporting:
 
     def html_print(self):
         data = self._nodes_parsed
-        print(tabulate(data, headers=self.get_header(), tablefmt="html"))
+        render_table(
+            data,
+            headers=self.get_header(),
+            tablefmt="html",
+            sort=self._sort,
+            reverse=self._reverse,
+            limit=self._limit,
+        )
 
     def pretty_print(self):
         data = self._nodes_parsed
-        print(tabulate(data, headers=self.get_header()))
+        render_table(
+            data,
+            headers=self.get_header(),
+            sort=self._sort,
+            reverse=self._reverse,
+            limit=self._limit,
+            page_size=self._page_size,
+        )
 
     def get_summary(self):
         summary = self._compute()
@@ -280,7 +313,7 @@ class Reporting:
 def main():
     if sys.version_info <= (3, 8):
         print(
-            f"Python version is too old: please load Python and needed modules. Ex: module load GCCcore/13.3.0 ClusterShell/1.9.3 tabulate2/1.10.0"
+            f"Python version is too old: please load Python and needed modules. Ex: module load GCCcore/13.3.0 ClusterShell/1.9.3"
         )
         exit()
 
@@ -63,6 +63,20 @@ class ArgumentParser:
         self.parser.add_argument(
             "--verbose", action="store_true", help="Verbose output."
         )
+        self.parser.add_argument(
+            "--sort", help="Sort the usage table by this column (ex: Used)."
+        )
+        self.parser.add_argument(
+            "--reverse", action="store_true", help="Sort in descending order."
+        )
+        self.parser.add_argument(
+            "--limit", type=int, help="Only print the first LIMIT rows."
+        )
+        self.parser.add_argument(
+            "--page-size",
+            type=int,
+            help="Repeat the table header every PAGE_SIZE rows.",
+        )
         self.parser.add_argument(
             "--invoice", action="store_true", help=argparse.SUPPRESS
         )
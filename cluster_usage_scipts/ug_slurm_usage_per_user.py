@@ -11,18 +11,18 @@ try:
     from io import StringIO
     from pathlib import Path
 
-    from tabulate2 import tabulate
+    from tablerender import render_table
     from ug_slurm_parse_args import ArgumentParser
 except ModuleNotFoundError as e:
     print(f"Missing module {e}")
     print(
-        "Please load the needed modules. Ex: module load GCCcore/13.3.0 Python/3.12.3 tabulate2/1.10.0 PyYAML/6.0.2"
+        "Please load the needed modules. Ex: module load GCCcore/13.3.0 Python/3.12.3 PyYAML/6.0.2 (tablerender.py must be next to this script)"
     )
     exit(1)
 
 if sys.version_info <= (3, 8):
     print(
-        "Python 3.8 or newer mandatory. You can use module to use a different python version: ml GCCcore/13.3.0 Python/3.12.3  tabulate2/1.10.0 PyYAML/6.0.2"
+        "Python 3.8 or newer mandatory. You can use module to use a different python version: ml GCCcore/13.3.0 Python/3.12.3 PyYAML/6.0.2"
     )
     print(f"Current version : {sys.version}")
     sys.exit(1)
@@ -205,14 +205,23 @@ class UsagePerAccount:
             print(f"stderr: {e.stderr}")
 
 
-def printDetailedUsage(usage, res, verbose):
+def printDetailedUsage(
+    usage, res, verbose, sort=None, reverse=False, limit=None, page_size=None
+):
     string_utils = StringUtils()
 
     # print header (multiline)
     for i in usage.getHeader():
         print(i)
     # print cluster usage
-    print(tabulate(res, headers="keys"))
+    render_table(
+        res,
+        headers="keys",
+        sort=sort,
+        reverse=reverse,
+        limit=limit,
+        page_size=page_size,
+    )
 
     if not verbose:
         total_usage = 0
@@ -313,7 +322,15 @@ def main():
         #  return
 
     else:
-        printDetailedUsage(usage, res, args.verbose)
+        printDetailedUsage(
+            usage,
+            res,
+            args.verbose,
+            sort=args.sort,
+            reverse=args.reverse,
+            limit=args.limit,
+            page_size=args.page_size,
+        )
 
 
 if __name__ == "__main__":
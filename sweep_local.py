@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Runs a small hyperparameter sweep of wandb_example.py within a single job.
+
+The dataset is loaded once into shared memory and the configurations (same
+--grid / --configs as sweep_submit.py) are trained concurrently by a pool of
+processes, sized to the allocated CPUs. Each configuration is a separate
+wandb run, with its own log (wandb) and checkpoint directories, so only the
+model changes between two configurations of a worker. The arguments after
+-- are given to all the configurations.
+
+    python sweep_local.py --name mlp --grid hidden_size=32,64,128 \\
+        --grid batch_size=64,128 --threads 2 -- --epochs 5 --wandb_mode offline
+"""
+
+import argparse
+import json
+import sys
+
+import torch
+import torch.multiprocessing as mp
+import wandb
+
+import wandb_example
+from sweep_submit import config_to_args, expand_configs, parse_grid_item
+
+# (train, test) (images, labels) of the worker, set by init_worker
+_data = None
+
+
+def to_shared(tensor):
+    """Copy of the tensor in shared memory, passed to the workers by handle."""
+    return torch.empty_like(tensor).share_memory_().copy_(tensor)
+
+
+def load_shared_data(data_dir):
+    return tuple(
+        tuple(map(to_shared, wandb_example.load_mnist_tensors(data_dir, train)))
+        for train in (True, False)
+    )
+
+
+def init_worker(data, threads):
+    global _data
+    _data = data
+    torch.set_num_threads(threads)
+
+
+def run_config(name, argv):
+    """Trains a configuration, returns (name, best validation loss, error)."""
+    args = wandb_example.get_parser().parse_args(argv)
+    try:
+        # the signals of Slurm are left to the sweep (SIGTERM stops the worker)
+        return name, wandb_example.run(args, data=_data, preemptible=False), None
+    except Exception as e:
+        print(f"{name} failed: {e!r}", file=sys.stderr)
+        # otherwise the next configuration of the worker logs to this run
+        if wandb.run is not None:
+            wandb.finish(exit_code=1)
+        return name, None, repr(e)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[1],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="\n".join(__doc__.splitlines()[2:]),
+    )
+    parser.add_argument("--name", required=True, help="Name of the sweep.")
+    parser.add_argument(
+        "--grid",
+        action="append",
+        default=[],
+        type=parse_grid_item,
+        metavar="KEY=V1,V2",
+        help="Values of an argument, the sweep is the product of all the grids.",
+    )
+    parser.add_argument(
+        "--configs", help="JSON list of configurations (dicts of arguments)."
+    )
+    parser.add_argument(
+        "--threads", type=int, default=1, help="Threads of each configuration."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="Configurations trained at once (0: the allocated CPUs / --threads).",
+    )
+    parser.add_argument("--data_dir", default="./data")
+    parser.add_argument(
+        "common", nargs="*", help="wandb_example.py arguments of all the configurations"
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    configs = []
+    if args.configs:
+        with open(args.configs, "r", encoding="utf-8") as f:
+            configs = json.load(f)
+    configs = expand_configs(dict(args.grid), configs, args.name)
+    if not configs:
+        print("No configuration to run, use --grid or --configs.", file=sys.stderr)
+        return 1
+
+    # the data is shared, the configurations don't need loader workers
+    common = [
+        "--data_dir",
+        args.data_dir,
+        "--num_workers",
+        "0",
+        "--num_threads",
+        str(args.threads),
+    ] + args.common
+    tasks = [(config["name"], common + config_to_args(config)) for config in configs]
+    # checks all the arguments before starting
+    parser = wandb_example.get_parser()
+    for _, argv in tasks:
+        parser.parse_args(argv)
+
+    workers = args.workers or wandb_example.get_allocated_cpus() // args.threads
+    workers = max(1, min(workers, len(tasks)))
+    print(f"{len(tasks)} configurations on {workers} workers")
+
+    data = load_shared_data(args.data_dir)
+    # spawn: the workers don't inherit the threads of torch or wandb
+    context = mp.get_context("spawn")
+    pool = context.Pool(workers, initializer=init_worker, initargs=(data, args.threads))
+    try:
+        results = pool.starmap(run_config, tasks, chunksize=1)
+    finally:
+        # not terminate(), the workers exit once their tasks are done
+        pool.close()
+        pool.join()
+
+    print(f"\n{'configuration':<30} best valid loss")
+    for name, best_valid_loss, error in results:
+        if error:
+            result = f"failed: {error}"
+        else:
+            result = f"{best_valid_loss:.4f}"
+        print(f"{name:<30} {result}")
+    return 1 if any(error for _, _, error in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Submits a hyperparameter sweep as a single Slurm job array.
+
+The grid (--grid key=v1,v2 ..., cartesian product) or list (--configs file.json)
+of configurations is expanded into sweeps/<name>/configs.json, indexed by the
+array task id. The generated job script resolves its configuration from
+SLURM_ARRAY_TASK_ID, so the whole sweep is submitted with one sbatch call.
+
+    python sweep_submit.py submit --name mlp --grid hidden_size=64,128,256 \\
+        --grid batch_size=64,128 --max-parallel 4 \\
+        --sbatch-arg=--partition=shared-gpu --sbatch-arg=--gres=gpu:1 \\
+        --command "srun apptainer run img.sif python wandb_example.py {args}"
+
+    # resubmit some configurations of the sweep
+    sbatch --array=3,5 sweeps/mlp/job.sh
+"""
+
+import argparse
+import itertools
+import json
+import os
+import shlex
+import subprocess
+import sys
+
+SWEEPS_DIR = "sweeps"
+SCRIPT_PATH = os.path.abspath(__file__)
+
+JOB_TEMPLATE = """\
+#!/usr/bin/env bash
+# generated by sweep_submit.py, submit with: sbatch --array=0-{last} {job_path}
+
+#SBATCH --job-name={name}
+#SBATCH --output={out_dir}/%A_%a.out
+#SBATCH --error={out_dir}/%A_%a.err
+{sbatch_lines}
+# arguments of the configuration SLURM_ARRAY_TASK_ID of {configs_path}, one per line
+CONFIG_LINES=$(python3 {script} resolve {configs_path}) || exit 1
+mapfile -t CONFIG_ARGS < <(printf '%s' "$CONFIG_LINES")
+echo "config $SLURM_ARRAY_TASK_ID: ${{CONFIG_ARGS[*]}}"
+
+{command}
+"""
+
+
+def parse_grid_item(item):
+    """Returns (key, [values]) from a key=v1,v2 --grid item."""
+    key, sep, values = item.partition("=")
+    if not sep or not key:
+        raise argparse.ArgumentTypeError(f"invalid grid {item!r}, use key=v1,v2")
+    return key, values.split(",")
+
+
+def expand_configs(grid=None, configs=None, name=None, name_arg="name"):
+    """
+    Returns the list of configurations: the given list, followed by the
+    cartesian product of the grid. If name_arg is set, each configuration
+    without it is named after the sweep and its index.
+    """
+    expanded = [dict(config) for config in configs or []]
+    if grid:
+        keys = list(grid)
+        for values in itertools.product(*(grid[key] for key in keys)):
+            expanded.append(dict(zip(keys, values)))
+    if name_arg and name:
+        for index, config in enumerate(expanded):
+            config.setdefault(name_arg, f"{name}_{index}")
+    return expanded
+
+
+def config_to_args(config):
+    """Command line arguments of a configuration (True: flag, False/None: unset)."""
+    args = []
+    for key, value in config.items():
+        if value is True:
+            args.append(f"--{key}")
+        elif value is not None and value is not False:
+            args.append(f"--{key}={value}")
+    return args
+
+
+def write_sweep(sweep_dir, name, configs, command, sbatch_args):
+    """Writes configs.json and job.sh in sweep_dir, returns the job script path."""
+    sweep_dir = os.path.abspath(sweep_dir)
+    out_dir = os.path.join(sweep_dir, "out")
+    os.makedirs(out_dir, exist_ok=True)
+
+    configs_path = os.path.join(sweep_dir, "configs.json")
+    with open(configs_path, "w", encoding="utf-8") as f:
+        json.dump({"name": name, "configs": configs}, f, indent=2)
+
+    if "{args}" not in command:
+        command += " {args}"
+    job_path = os.path.join(sweep_dir, "job.sh")
+    with open(job_path, "w", encoding="utf-8") as f:
+        f.write(
+            JOB_TEMPLATE.format(
+                last=len(configs) - 1,
+                job_path=job_path,
+                name=name,
+                out_dir=out_dir,
+                sbatch_lines="".join(f"#SBATCH {arg}\n" for arg in sbatch_args),
+                script=shlex.quote(SCRIPT_PATH),
+                configs_path=shlex.quote(configs_path),
+                command=command.replace("{args}", '"${CONFIG_ARGS[@]}"'),
+            )
+        )
+    os.chmod(job_path, 0o755)
+    return job_path
+
+
+def submit(args):
+    configs = []
+    if args.configs:
+        with open(args.configs, "r", encoding="utf-8") as f:
+            configs = json.load(f)
+    configs = expand_configs(dict(args.grid), configs, args.name, args.name_arg)
+    if not configs:
+        print("No configuration to submit, use --grid or --configs.", file=sys.stderr)
+        return 1
+
+    sweep_dir = args.sweep_dir or os.path.join(SWEEPS_DIR, args.name)
+    job_path = write_sweep(sweep_dir, args.name, configs, args.command, args.sbatch_arg)
+
+    array = f"0-{len(configs) - 1}"
+    if args.max_parallel:
+        array += f"%{args.max_parallel}"
+    command = [args.sbatch, "--parsable", f"--array={array}", job_path]
+    print(f"{len(configs)} configurations written to {sweep_dir}")
+    if args.dry_run:
+        print(f"[DRYRUN] {shlex.join(command)}")
+        return 0
+
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"sbatch failed: {result.stderr.strip()}", file=sys.stderr)
+        return result.returncode
+    job_id = result.stdout.strip().split(";")[0]
+    print(f"Submitted job array {job_id} ({array})")
+    return 0
+
+
+def resolve(args):
+    index = args.index
+    if index is None:
+        index = int(os.environ["SLURM_ARRAY_TASK_ID"])
+    with open(args.configs_path, "r", encoding="utf-8") as f:
+        configs = json.load(f)["configs"]
+    config_args = config_to_args(configs[index])
+    # read line by line by job.sh, so each argument stays a single word
+    if any("\n" in arg for arg in config_args):
+        print(f"Configuration {index} has a value with a newline.", file=sys.stderr)
+        return 1
+    print("\n".join(config_args))
+    return 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[1],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="\n".join(__doc__.splitlines()[2:]),
+    )
+    subparsers = parser.add_subparsers(dest="action", required=True)
+
+    sub = subparsers.add_parser("submit", help="Expand and submit a sweep.")
+    sub.add_argument("--name", required=True, help="Name of the sweep.")
+    sub.add_argument(
+        "--grid",
+        action="append",
+        default=[],
+        type=parse_grid_item,
+        metavar="KEY=V1,V2",
+        help="Values of an argument, the sweep is the product of all the grids.",
+    )
+    sub.add_argument(
+        "--configs", help="JSON list of configurations (dicts of arguments)."
+    )
+    sub.add_argument(
+        "--command",
+        required=True,
+        help="Command run by each task, {args} is replaced by the arguments "
+        "of the configuration (appended if missing).",
+    )
+    sub.add_argument(
+        "--max-parallel", type=int, help="Maximum number of tasks running at once."
+    )
+    sub.add_argument(
+        "--sbatch-arg",
+        action="append",
+        default=[],
+        help="Option added to the job script, eg. --sbatch-arg=--partition=shared-gpu",
+    )
+    sub.add_argument(
+        "--name-arg",
+        default="name",
+        help="Argument set to <name>_<index> if missing from a configuration "
+        "('' to disable).",
+    )
+    sub.add_argument("--sweep-dir", help="Default: sweeps/<name>.")
+    sub.add_argument(
+        "--sbatch",
+        default="sbatch",
+        help="sbatch executable (eg. a fake one for testing).",
+    )
+    sub.add_argument(
+        "--dry-run", action="store_true", help="Write the sweep but do not submit it."
+    )
+
+    res = subparsers.add_parser(
+        "resolve",
+        help="Print the arguments of a configuration, one per line (used by job.sh).",
+    )
+    res.add_argument("configs_path")
+    res.add_argument("--index", type=int, help="Default: $SLURM_ARRAY_TASK_ID.")
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.action == "submit":
+        return submit(args)
+    return resolve(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
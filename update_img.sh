@@ -4,7 +4,7 @@
 #
 #==============================================================================
 
-VERSION="1.0.1"
+VERSION="1.1.0"
 
 SCRIPT_PATH="$(dirname "$0")"
 
@@ -18,14 +18,26 @@ IMG_NAME=image
 
 # name of the folder where to save old images
 OLD_FOLDER_NAME=old
+# number of images kept in the old folder (0 keeps them all)
+KEEP_OLD=3
 # name of the tmp folder for apptainer
 TMP_FOLDER_NAME=tmp
+# name of the folder where apptainer caches the layers, kept between builds
+# (ignored if APPTAINER_CACHEDIR is set)
+CACHE_FOLDER_NAME=cache
+
+# source of the image, default: docker://$DOCKER_REGISTRY
+SOURCE=""
+
+# apptainer executable, can be overridden (eg. by a fake one for testing)
+APPTAINER_BIN=${APPTAINER_BIN:-apptainer}
 
 CONNECTION=false
 UPDATE_SCRIPT=false
+FORCE=false
 
 function usage() {
-    echo "usage: $programname [-vhc] [-du docker_username] [-dp docker_password] [-dr docker_registry] [-n name] [-o old_folder]"
+    echo "usage: $programname [-vhcf] [-du docker_username] [-dp docker_password] [-dr docker_registry] [-s source] [-n name] [-o old_folder] [-k keep]"
     echo "  -v  version             version"
     echo "  -h  help                display help"
     echo "  -u  update              update the current script"
@@ -33,8 +45,12 @@ function usage() {
     echo "  -du docker_username     specify the docker username (neeeds c parameter to connect to docker)"
     echo "  -dp docker_password     specify the docker password (neeeds c parameter to connect to docker)"
     echo "  -dr docker_registry     specify the docker registry, eg. candidj0/milozero:latest"
+    echo "  -s  source              specify the source of the image instead of the docker registry,"
+    echo "                          eg. docker://candidj0/milozero:latest, oci:path/to/dir, oci-archive:image.tar"
+    echo "  -f  force               rebuild the image even if the source digest did not change"
     echo "  -n  name                specify the name of the image (to be saved), eg. milozero.sif"
     echo "  -o  old_folder          specify the name of the folder where to save old images"
+    echo "  -k  keep                number of images to keep in the old folder (0 keeps them all, default $KEEP_OLD)"
     echo "  -t  tmp_folder          specify the name of the tmp folder (used by apptainer)"
 }
 
@@ -44,20 +60,91 @@ function connect() {
 }
 
 
-function check_mv_old() {
+function registry_digest() {
+    # digest of a docker reference from the registry API, eg. candidj0/milozero:latest
+    local ref=$1 registry=registry-1.docker.io tag=latest repo token
+    local auth=()
+    # registry host in the reference, eg. ghcr.io/user/image:tag
+    if [[ $ref == */* && ${ref%%/*} == *[.:]* ]]; then
+        registry=${ref%%/*}
+        ref=${ref#*/}
+    fi
+    if [[ ${ref##*/} == *:* ]]; then
+        tag=${ref##*:}
+        ref=${ref%:*}
+    fi
+    repo=$ref
+    if [ "$registry" = registry-1.docker.io ]; then
+        [[ $repo != */* ]] && repo=library/$repo
+        [ "$CONNECTION" = true ] && auth=(-u "$DOCKER_USERNAME:$DOCKER_PASSWORD")
+        token=$(curl -fsS "${auth[@]}" \
+            "https://auth.docker.io/token?service=registry.docker.io&scope=repository:$repo:pull" \
+            | sed -n 's/.*"token" *: *"\([^"]*\)".*/\1/p')
+        [ -n "$token" ] || return
+        auth=(-H "Authorization: Bearer $token")
+    fi
+    curl -fsSI "${auth[@]}" \
+        -H "Accept: application/vnd.oci.image.index.v1+json" \
+        -H "Accept: application/vnd.oci.image.manifest.v1+json" \
+        -H "Accept: application/vnd.docker.distribution.manifest.list.v2+json" \
+        -H "Accept: application/vnd.docker.distribution.manifest.v2+json" \
+        "https://$registry/v2/$repo/manifests/$tag" 2> /dev/null \
+        | tr -d '\r' | sed -n 's/^[Dd]ocker-[Cc]ontent-[Dd]igest: *//p'
+}
+
+function source_digest() {
+    # prints the digest of the image at $SOURCE, nothing if it can't be resolved
+    local ref index
+    case "$SOURCE" in
+        docker://*)
+            ref=${SOURCE#docker://}
+            if [[ $ref == *@sha256:* ]]; then
+                echo "${ref#*@}"
+            elif command -v skopeo > /dev/null; then
+                local creds=()
+                [ "$CONNECTION" = true ] && creds=(--creds "$DOCKER_USERNAME:$DOCKER_PASSWORD")
+                skopeo inspect "${creds[@]}" --format '{{.Digest}}' "$SOURCE" 2> /dev/null
+            else
+                registry_digest "$ref"
+            fi
+            ;;
+        oci:*)
+            # the index of an OCI layout references the manifests of its images
+            ref=${SOURCE#oci:}
+            index=$(cat "${ref%%:*}/index.json" 2> /dev/null) || return
+            echo "sha256:$(printf '%s' "$index" | sha256sum | cut -d' ' -f1)"
+            ;;
+        oci-archive:*)
+            ref=${SOURCE#oci-archive:}
+            index=$(tar -xOf "${ref%%:*}" index.json 2> /dev/null \
+                || tar -xOf "${ref%%:*}" ./index.json 2> /dev/null) || return
+            echo "sha256:$(printf '%s' "$index" | sha256sum | cut -d' ' -f1)"
+            ;;
+    esac
+}
+
+function prune_old() {
+    # keeps the KEEP_OLD most recent images of the old folder
+    [ "$KEEP_OLD" -gt 0 ] || return 0
+    local old_images old_img
+    mapfile -t old_images < <(ls -1t "$OLD_FOLDER"/"$IMG_NAME"_*.sif 2> /dev/null)
+    for old_img in "${old_images[@]:$KEEP_OLD}"; do
+        rm -f "$old_img"
+        echo "[INFO] removed $old_img"
+    done
+}
+
+function move_old() {
     OLD_FOLDER=$SCRIPT_PATH/$OLD_FOLDER_NAME
     if [ -f "$IMG_PATH" ]; then
-        echo "[ERROR] $IMG_PATH exist!"
-        read -p "Do you want to move it to old image folder?[y/n] " -r
-        if [[ $REPLY =~ ^[Yy]$ ]]; then
-            if [ ! -d "$OLD_FOLDER" ]; then
-                echo "[INFO] folder $OLD_FOLDER doesn't exit.."
-                mkdir $OLD_FOLDER
-                echo "[INFO] folder $OLD_FOLDER created!"
-            fi
-            mv $IMG_PATH $OLD_FOLDER/"$IMG_NAME"_$(date +%s).sif
-            echo "[INFO] image moved to old image folder."
+        if [ ! -d "$OLD_FOLDER" ]; then
+            echo "[INFO] folder $OLD_FOLDER doesn't exit.."
+            mkdir $OLD_FOLDER
+            echo "[INFO] folder $OLD_FOLDER created!"
         fi
+        mv $IMG_PATH $OLD_FOLDER/"$IMG_NAME"_$(date +%s).sif
+        echo "[INFO] previous image moved to old image folder."
+        prune_old
     fi
 }
 
@@ -70,15 +157,50 @@ function check_tmp_folder() {
     fi
 }
 
-function pull_image() {
-    if [ ! -f "$IMG_PATH" ]; then
-        TMP_FOLDER="$(pwd)"/$TMP_FOLDER_NAME
-        check_tmp_folder
-	export APPTAINER_TMPDIR=$TMP_FOLDER
-        apptainer build --fakeroot $IMG_PATH docker://$DOCKER_REGISTRY
+function build_image() {
+    local digest=$1
+    # built next to the image and swapped in only once complete
+    local new_img="$IMG_PATH.new"
+
+    TMP_FOLDER="$(pwd)"/$TMP_FOLDER_NAME
+    check_tmp_folder
+    export APPTAINER_TMPDIR=$TMP_FOLDER
+    # layers already downloaded by a previous build are reused
+    export APPTAINER_CACHEDIR=${APPTAINER_CACHEDIR:-$(cd "$SCRIPT_PATH" && pwd)/$CACHE_FOLDER_NAME}
+    mkdir -p "$APPTAINER_CACHEDIR"
+
+    rm -f "$new_img"
+    if ! $APPTAINER_BIN build --fakeroot "$new_img" "$SOURCE"; then
+        rm -f "$new_img"
+        echo "[ERROR] build from $SOURCE failed, $IMG_PATH is unchanged."
+        return 1
+    fi
+    move_old
+    mv "$new_img" "$IMG_PATH"
+    if [ -n "$digest" ]; then
+        echo "$SOURCE $digest" > "$DIGEST_PATH"
     else
-        echo "[ERROR] you must remove/move $IMG_PATH before pulling a new image."
+        rm -f "$DIGEST_PATH"
+    fi
+    echo "[INFO] $IMG_PATH built from $SOURCE ${digest:-(unknown digest)}"
+}
+
+function update_image() {
+    # the digest of the source is recorded next to the image, the build is
+    # skipped while it does not change
+    local digest recorded=""
+    DIGEST_PATH="$IMG_PATH.digest"
+    digest=$(source_digest)
+    [ -f "$DIGEST_PATH" ] && read -r recorded < "$DIGEST_PATH"
+    if [ "$FORCE" != true ] && [ -n "$digest" ] && [ -f "$IMG_PATH" ] \
+        && [ "$recorded" = "$SOURCE $digest" ]; then
+        echo "[INFO] $IMG_PATH is up to date with $SOURCE ($digest)."
+        return 0
+    fi
+    if [ -z "$digest" ]; then
+        echo "[INFO] digest of $SOURCE unknown, building the image."
     fi
+    build_image "$digest"
 }
 
 function update_from_github() {
@@ -120,6 +242,18 @@ while [[ "$#" -gt 0 ]]; do
             DOCKER_REGISTRY="$2"
             shift 2
             ;;
+        -s|--source)
+            SOURCE="$2"
+            shift 2
+            ;;
+        -f|--force)
+            FORCE=true
+            shift
+            ;;
+        -k|--keep)
+            KEEP_OLD="$2"
+            shift 2
+            ;;
         -n|--img_name)
             IMG_NAME="$2"
             shift 2
@@ -150,9 +284,12 @@ if [ "$CONNECTION" = true ]; then
     connect
 fi
 
-if [ -n "$DOCKER_REGISTRY" ]; then
-    check_mv_old
-    pull_image
+if [ -z "$SOURCE" ] && [ -n "$DOCKER_REGISTRY" ]; then
+    SOURCE="docker://$DOCKER_REGISTRY"
+fi
+
+if [ -n "$SOURCE" ]; then
+    update_image
 else
     echo "If you are trying to pull an image don't forget to specify a docker registry."
 fi
@@ -1,24 +1,260 @@
 import argparse
+import json
 import os
 import os.path as osp
+import queue
+import random
+import resource
+import signal
+import subprocess
+import threading
 import time
 
 import numpy as np
 import torch
+import torch.distributed as dist
 import torch.nn as nn
 import wandb
-from torch.utils.data import DataLoader, random_split
+from torch.nn.parallel import DistributedDataParallel
+from torch.profiler import ProfilerActivity, profile, schedule
+from torch.utils.data import (
+    BatchSampler,
+    DataLoader,
+    Dataset,
+    DistributedSampler,
+    RandomSampler,
+    SequentialSampler,
+    random_split,
+)
 from torchvision import datasets, transforms
 
+# torchvision: PIL images converted one sample at a time by the transforms
+# tensor: whole dataset decoded once into a memory-mapped tensor, batches
+#         gathered by index
+DATA_MODES = ("torchvision", "tensor")
+
+
+def load_mnist_tensors(data_dir, train):
+    """
+    Returns the MNIST images as a normalized float32 tensor (N, 1, 28, 28) and
+    the labels. They are decoded once into .npy files in data_dir/MNIST/tensor
+    and memory-mapped from there afterwards.
+    """
+    split = "train" if train else "test"
+    cache_dir = osp.join(data_dir, "MNIST", "tensor")
+    images_path = osp.join(cache_dir, f"{split}_images.npy")
+    labels_path = osp.join(cache_dir, f"{split}_labels.npy")
+
+    if not (osp.exists(images_path) and osp.exists(labels_path)):
+        dataset = datasets.MNIST(root=data_dir, train=train, download=True)
+        # same values as transforms.ToTensor(), for the whole dataset at once
+        images = dataset.data.unsqueeze(1).float().div_(255).numpy()
+        labels = dataset.targets.numpy()
+        os.makedirs(cache_dir, exist_ok=True)
+        for path, array in ((images_path, images), (labels_path, labels)):
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, array)
+            os.replace(tmp_path, path)
+
+    # copy-on-write mapping: the pages are read lazily and shared between
+    # the processes using the same file
+    images = torch.from_numpy(np.load(images_path, mmap_mode="c"))
+    labels = torch.from_numpy(np.load(labels_path, mmap_mode="c"))
+    return images, labels
+
+
+def get_allocated_cpus():
+    """CPUs allocated to the job by Slurm, or usable by the process otherwise."""
+    if os.environ.get("SLURM_CPUS_PER_TASK"):
+        return int(os.environ["SLURM_CPUS_PER_TASK"])
+    # shared by the processes launched on the node by torchrun
+    local_processes = int(os.environ.get("LOCAL_WORLD_SIZE", 1))
+    return max(1, len(os.sched_getaffinity(0)) // local_processes)
+
+
+def get_loader_kwargs(
+    num_workers=-1,
+    pin_memory=None,
+    persistent_workers=None,
+    prefetch_factor=2,
+    device="cpu",
+    sample_transforms=True,
+):
+    """
+    DataLoader keyword arguments of the data pipeline. num_workers < 0 uses all
+    the allocated CPUs but the one of the training process when the workers
+    are useful: to prepare the batches while a GPU computes, or to run the
+    per sample transforms (sample_transforms). On CPU the batched pipelines
+    only index tensors, the CPUs are better used by the training process.
+    pin_memory and persistent_workers default to on for GPUs and with workers
+    respectively.
+    """
+    if num_workers < 0:
+        if device.startswith("cuda") or sample_transforms:
+            num_workers = max(0, get_allocated_cpus() - 1)
+        else:
+            num_workers = 0
+    if pin_memory is None:
+        pin_memory = device.startswith("cuda")
+    kwargs = {"num_workers": num_workers, "pin_memory": pin_memory}
+    if num_workers > 0:
+        kwargs["persistent_workers"] = (
+            True if persistent_workers is None else persistent_workers
+        )
+        kwargs["prefetch_factor"] = prefetch_factor
+    return kwargs
+
+
+def uint8_to_float(images):
+    """Batched transforms.ToTensor() of uint8 images (N, 1, H, W)."""
+    return images.float().div_(255)
+
+
+class BatchedTensorDataset(Dataset):
+    """
+    Dataset indexed with a whole batch of indices, so a batch is gathered with
+    one tensor indexing (and transformed at once) instead of one __getitem__
+    per sample. It is used with a BatchSampler as sampler and batch_size=None
+    (see batched_loader).
+    """
+
+    def __init__(self, images, labels, indices=None, transform=None):
+        self.images = images
+        self.labels = labels
+        # rows of the split, None for all of them
+        self.indices = indices
+        # applied to the images of a whole batch
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.labels) if self.indices is None else len(self.indices)
+
+    def __getitem__(self, batch):
+        batch = torch.as_tensor(batch)
+        if self.indices is not None:
+            batch = self.indices[batch]
+        images = self.images[batch]
+        if self.transform is not None:
+            images = self.transform(images)
+        return images, self.labels[batch]
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def make_sampler(dataset, shuffle):
+    """Sampler of the dataset, split between the processes in data-parallel mode."""
+    if is_distributed():
+        return DistributedSampler(dataset, shuffle=shuffle)
+    return RandomSampler(dataset) if shuffle else SequentialSampler(dataset)
+
+
+def set_sampler_epoch(loader, epoch):
+    """Reshuffles the DistributedSampler of the loader for the epoch."""
+    # the loaders of batched datasets sample through a BatchSampler
+    sampler = getattr(loader.sampler, "sampler", loader.sampler)
+    if isinstance(sampler, DistributedSampler):
+        sampler.set_epoch(epoch)
+
+
+def batched_loader(dataset, batch_size, shuffle, loader_kwargs=None):
+    return DataLoader(
+        dataset,
+        sampler=BatchSampler(
+            make_sampler(dataset, shuffle), batch_size, drop_last=False
+        ),
+        batch_size=None,
+        **(loader_kwargs or {}),
+    )
+
+
+def get_batched_dataloaders(
+    batch_size,
+    train_data,
+    test_data,
+    transform=None,
+    loader_kwargs=None,
+    eval_batch_size=None,
+):
+    """Loaders of BatchedTensorDatasets over the (images, labels) of each split."""
+    eval_batch_size = eval_batch_size or batch_size
+    images, labels = train_data
+
+    # same split as random_split: 10% of the training set for validation
+    validation_set_size = int(0.1 * len(labels))
+    permutation = torch.randperm(len(labels))
+    train_set = BatchedTensorDataset(
+        images, labels, permutation[: len(labels) - validation_set_size], transform
+    )
+    # sorted so that the validation reads the images sequentially
+    validation_set = BatchedTensorDataset(
+        images,
+        labels,
+        permutation[len(labels) - validation_set_size :].sort().values,
+        transform,
+    )
+    test_set = BatchedTensorDataset(*test_data, transform=transform)
+
+    train_loader = batched_loader(train_set, batch_size, True, loader_kwargs)
+    validation_loader = batched_loader(
+        validation_set, eval_batch_size, False, loader_kwargs
+    )
+    test_loader = batched_loader(test_set, eval_batch_size, False, loader_kwargs)
+    return train_loader, validation_loader, test_loader
+
+
+def get_dataloaders(
+    batch_size,
+    data_mode="torchvision",
+    data_dir="./data",
+    loader_kwargs=None,
+    batch_transforms=False,
+    eval_batch_size=None,
+):
+    """
+    Returns the train, validation and test loaders. Once torch.distributed is
+    initialized, each process gets its own shard of every split.
+
+    :param loader_kwargs: DataLoader options of the pipeline (see get_loader_kwargs)
+    :param batch_transforms: in torchvision mode, keep the raw images in memory
+        and convert them per batch instead of per sample
+    :param eval_batch_size: batch size of the validation and test loaders
+        (default: batch_size)
+    """
+    loader_kwargs = loader_kwargs or {}
+    if data_mode == "tensor":
+        return get_batched_dataloaders(
+            batch_size,
+            load_mnist_tensors(data_dir, train=True),
+            load_mnist_tensors(data_dir, train=False),
+            loader_kwargs=loader_kwargs,
+            eval_batch_size=eval_batch_size,
+        )
+    if batch_transforms:
+        train_dataset, test_dataset = (
+            datasets.MNIST(root=data_dir, train=train, download=True)
+            for train in (True, False)
+        )
+        return get_batched_dataloaders(
+            batch_size,
+            (train_dataset.data.unsqueeze(1), train_dataset.targets),
+            (test_dataset.data.unsqueeze(1), test_dataset.targets),
+            transform=uint8_to_float,
+            loader_kwargs=loader_kwargs,
+            eval_batch_size=eval_batch_size,
+        )
+
+    eval_batch_size = eval_batch_size or batch_size
 
-def get_dataloaders(batch_size):
     # Define transformations
     # 1. convert to tensor
     transform = transforms.Compose([transforms.ToTensor()])
 
     # Load MNIST dataset
     cifar_dataset = datasets.MNIST(
-        root="./data", train=True, download=True, transform=transform
+        root=data_dir, train=True, download=True, transform=transform
     )
 
     # Define the size of your validation set
@@ -32,14 +268,29 @@ def get_dataloaders(batch_size):
     )
 
     # Create DataLoader for training, validation, and test sets
-    train_loader = DataLoader(train_set, batch_size=batch_size, shuffle=True)
-    validation_loader = DataLoader(validation_set, batch_size=batch_size, shuffle=False)
+    train_loader = DataLoader(
+        train_set,
+        batch_size=batch_size,
+        sampler=make_sampler(train_set, shuffle=True),
+        **loader_kwargs,
+    )
+    validation_loader = DataLoader(
+        validation_set,
+        batch_size=eval_batch_size,
+        sampler=make_sampler(validation_set, shuffle=False),
+        **loader_kwargs,
+    )
 
     # For the test set
     test_dataset = datasets.MNIST(
-        root="./data", train=False, download=True, transform=transform
+        root=data_dir, train=False, download=True, transform=transform
+    )
+    test_loader = DataLoader(
+        test_dataset,
+        batch_size=eval_batch_size,
+        sampler=make_sampler(test_dataset, shuffle=False),
+        **loader_kwargs,
     )
-    test_loader = DataLoader(test_dataset, batch_size=batch_size, shuffle=False)
     return train_loader, validation_loader, test_loader
 
 
@@ -59,91 +310,693 @@ class MLP(nn.Module):
         return x
 
 
-def main(args):
-    train_loader, validation_loader, test_loader = get_dataloaders(
-        batch_size=args.batch_size
+# eager: fp32 as is, compile: torch.compile of the forward pass and loss (and of
+# their backward through AOTAutograd), bf16: bfloat16 autocast (on CPU or GPU)
+EXEC_MODES = ("eager", "compile", "bf16", "compile_bf16")
+
+
+def make_forward_loss(model, loss_fn, exec_mode="eager", device="cpu"):
+    """Returns forward_loss(images, labels) -> (outputs, loss) of the mode."""
+    device_type = "cuda" if device.startswith("cuda") else "cpu"
+    use_bf16 = exec_mode.endswith("bf16")
+
+    def forward_loss(images, labels):
+        # autocast keeps the loss in fp32
+        with torch.autocast(device_type, dtype=torch.bfloat16, enabled=use_bf16):
+            outputs = model(images)
+            loss = loss_fn(outputs, labels)
+        return outputs, loss
+
+    if exec_mode.startswith("compile"):
+        return torch.compile(forward_loss)
+    return forward_loss
+
+
+class MetricAccumulator:
+    """
+    Sums of the loss and of the correct predictions kept on the device, so the
+    loops don't synchronize with the device at every step. They are read, with
+    a single synchronization, by compute().
+    """
+
+    def __init__(self, device):
+        # loss * samples, correct predictions, samples
+        self.sums = torch.zeros(3, dtype=torch.float64, device=device)
+
+    def update(self, loss, labels, outputs=None):
+        n_samples = labels.size(0)
+        self.sums[0] += loss.detach() * n_samples
+        self.sums[2] += n_samples
+        if outputs is not None:
+            self.sums[1] += (outputs.argmax(1) == labels).sum()
+
+    def compute(self):
+        """
+        Returns the mean loss and the accuracy (%) since the last reset, over
+        all the processes in data-parallel mode (to be called by all of them).
+        """
+        sums = self.sums
+        if is_distributed():
+            sums = sums.clone()
+            dist.all_reduce(sums)
+        loss_sum, correct, total = sums.tolist()
+        total = max(total, 1)
+        return {"loss": loss_sum / total, "accuracy": 100 * correct / total}
+
+    def reset(self):
+        self.sums.zero_()
+
+
+class StepTimer:
+    """
+    Time spent per training step in each phase. The data wait is measured on
+    the host; on CUDA the other phases are timed with CUDA events, read once
+    by compute() (which synchronizes), on CPU with perf_counter.
+    """
+
+    PHASES = ("data", "forward", "backward", "optimizer")
+
+    def __init__(self, device):
+        self.device = device
+        self.cuda = device.startswith("cuda")
+        self.reset()
+
+    def _now(self):
+        if self.cuda:
+            event = torch.cuda.Event(enable_timing=True)
+            event.record()
+            return event
+        return time.perf_counter()
+
+    def reset(self):
+        """Starts the epoch, also resets the peak memory."""
+        self.totals = dict.fromkeys(self.PHASES, 0.0)  # seconds
+        self.marks = []  # (phase, CUDA event) of the steps
+        self.steps = 0
+        self.samples = 0
+        if self.cuda:
+            torch.cuda.reset_peak_memory_stats(self.device)
+        self.host_last = time.perf_counter()
+        self.start = self._now()
+        self.end = None
+
+    def mark(self, phase):
+        """Ends the phase started by the previous mark (or the previous step)."""
+        now = time.perf_counter()
+        if phase == "data" or not self.cuda:
+            self.totals[phase] += now - self.host_last
+        if self.cuda:
+            self.marks.append((phase, self._now()))
+        self.host_last = now
+
+    def end_step(self, samples):
+        self.steps += 1
+        self.samples += samples
+
+    def stop(self):
+        """Ends the epoch, without synchronizing."""
+        self.end = self._now()
+
+    def compute(self):
+        """Returns the mean time per step of each phase and the throughput."""
+        if self.end is None:
+            self.stop()
+        totals = dict(self.totals)
+        if self.cuda:
+            self.end.synchronize()
+            seconds = self.start.elapsed_time(self.end) / 1000
+            for (_, previous), (phase, event) in zip(self.marks, self.marks[1:]):
+                if phase != "data":
+                    totals[phase] += previous.elapsed_time(event) / 1000
+            peak_memory = torch.cuda.max_memory_allocated(self.device)
+        else:
+            seconds = self.end - self.start
+            # peak of the process (kB on Linux), not only of this epoch
+            peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+        steps = max(self.steps, 1)
+        metrics = {f"{phase}_ms": 1000 * totals[phase] / steps for phase in totals}
+        metrics["step_ms"] = sum(metrics.values())
+        metrics["data_pct"] = 100 * totals["data"] / max(sum(totals.values()), 1e-9)
+        metrics["samples_per_s"] = self.samples / max(seconds, 1e-9)
+        metrics["peak_memory_mb"] = peak_memory / 2**20
+        metrics.update(steps=self.steps, samples=self.samples, seconds=seconds)
+        return metrics
+
+
+def summarize_throughput(epochs):
+    """Aggregates the StepTimer metrics of several epochs."""
+    steps = max(sum(epoch["steps"] for epoch in epochs), 1)
+    samples = sum(epoch["samples"] for epoch in epochs)
+    seconds = sum(epoch["seconds"] for epoch in epochs)
+    summary = {
+        key: sum(epoch[key] * epoch["steps"] for epoch in epochs) / steps
+        for key in ("data_ms", "forward_ms", "backward_ms", "optimizer_ms", "step_ms")
+    }
+    summary["data_pct"] = 100 * summary["data_ms"] / max(summary["step_ms"], 1e-9)
+    summary["samples_per_s"] = samples / max(seconds, 1e-9)
+    summary["peak_memory_mb"] = max(
+        (epoch["peak_memory_mb"] for epoch in epochs), default=0
+    )
+    summary.update(steps=steps, samples=samples, seconds=seconds)
+    return summary
+
+
+def write_throughput_summary(path, epochs, args):
+    """Writes the per epoch and total throughput metrics of the run as JSON."""
+    summary = {
+        "device": args.device,
+        "world_size": args.world_size,
+        "batch_size": args.batch_size,
+        "epochs": epochs,
+        "total": summarize_throughput(epochs),
+    }
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+PROFILE_TOP_OPS = 30  # rows of the top ops tables
+
+
+def make_profiler(args, out_dir):
+    """
+    torch.profiler over the window of training steps of the --profile_*
+    options, writing a Chrome trace and a table of the top ops of each window
+    in out_dir.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    activities = [ProfilerActivity.CPU]
+    sort_by = "self_cpu_time_total"
+    if args.device.startswith("cuda"):
+        activities.append(ProfilerActivity.CUDA)
+        sort_by = "self_cuda_time_total"
+
+    def on_trace_ready(profiler):
+        name = f"step_{profiler.step_num}"
+        trace_path = osp.join(out_dir, f"trace_{name}.json")
+        profiler.export_chrome_trace(trace_path)
+        with open(osp.join(out_dir, f"top_ops_{name}.txt"), "w") as f:
+            f.write(
+                profiler.key_averages().table(
+                    sort_by=sort_by, row_limit=PROFILE_TOP_OPS
+                )
+            )
+        print(f"Profile written to {trace_path}")
+
+    return profile(
+        activities=activities,
+        schedule=schedule(
+            wait=args.profile_wait,
+            warmup=args.profile_warmup,
+            active=args.profile_active,
+            repeat=args.profile_repeat,
+        ),
+        on_trace_ready=on_trace_ready,
+        record_shapes=True,
+        profile_memory=True,
+    )
+
+
+def snapshot(state):
+    """Copy of a (nested) state with its tensors on the CPU."""
+    if isinstance(state, torch.Tensor):
+        return state.detach().to("cpu", copy=True)
+    if isinstance(state, dict):
+        return {key: snapshot(value) for key, value in state.items()}
+    if isinstance(state, (list, tuple)):
+        return type(state)(snapshot(value) for value in state)
+    return state
+
+
+def save_atomic(state, path):
+    """torch.save next to path then rename, so path is never partially written."""
+    tmp_path = f"{path}.tmp"
+    torch.save(state, tmp_path)
+    os.replace(tmp_path, path)
+
+
+class CheckpointWriter:
+    """
+    Saves checkpoints on a background thread. The state is copied to the CPU
+    on the training thread (so later updates don't leak into it), then
+    serialized and written atomically by the thread while training goes on.
+    """
+
+    def __init__(self, max_pending=2):
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def save(self, state, path):
+        self.queue.put((snapshot(state), path))
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                state, path = item
+                save_atomic(state, path)
+            except Exception as e:
+                print(f"Checkpoint {item[1]} failed: {e}")
+            finally:
+                self.queue.task_done()
+
+    def flush(self):
+        """Waits for the pending checkpoints to be written."""
+        self.queue.join()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+def get_rng_state():
+    return {
+        "torch": torch.get_rng_state(),
+        "cuda": torch.cuda.get_rng_state_all() if torch.cuda.is_available() else [],
+        "numpy": np.random.get_state(),
+        "python": random.getstate(),
+    }
+
+
+def set_rng_state(state):
+    torch.set_rng_state(state["torch"])
+    if state["cuda"] and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+    np.random.set_state(state["numpy"])
+    random.setstate(state["python"])
+
+
+# arguments a checkpoint must share with the run that resumes it (--resume auto)
+RESUME_ARGS = ("hidden_size", "batch_size", "epochs")
+
+
+def get_checkpoint_state(model, optimizer, epoch, best_valid_loss, args):
+    """Full training state, epoch being the number of completed epochs."""
+    return {
+        "model": model.state_dict(),
+        "optimizer": optimizer.state_dict(),
+        "epoch": epoch,
+        "best_valid_loss": best_valid_loss,
+        "rng": get_rng_state(),
+        "args": vars(args),
+    }
+
+
+def check_resume_args(state, args, path):
+    """
+    Raises if the checkpoint was trained with other RESUME_ARGS than args: the
+    experiment name was reused for another configuration.
+    """
+    saved = state.get("args", {})
+    changed = [
+        f"--{key} {saved[key]} (now {getattr(args, key)})"
+        for key in RESUME_ARGS
+        if key in saved and saved[key] != getattr(args, key)
+    ]
+    if changed:
+        raise ValueError(
+            f"{path} of the experiment {args.name} was trained with "
+            f"{', '.join(changed)}: use another --name, or --resume never to "
+            "start over."
+        )
+
+
+def restore_checkpoint(path, model, optimizer, args=None):
+    """
+    Restores the training state, returns (epoch, best_valid_loss).
+    args: the current arguments, checked against the ones of the checkpoint.
+    """
+    # the RNG states are not plain tensors
+    state = torch.load(path, map_location="cpu", weights_only=False)
+    if args is not None:
+        check_resume_args(state, args, path)
+    model.load_state_dict(state["model"])
+    optimizer.load_state_dict(state["optimizer"])
+    set_rng_state(state["rng"])
+    return state["epoch"], state["best_valid_loss"]
+
+
+def find_resume_checkpoint(args, latest_path, download=True):
+    """
+    Returns the checkpoint to resume from: --resume if it is a path, otherwise
+    (auto) the latest one of the experiment, downloaded from --wandb_run_path
+    if it is missing locally (or with --wandb_download_replace).
+    """
+    if args.resume == "never":
+        return None
+    if args.resume != "auto":
+        return args.resume
+    if (
+        download
+        and args.wandb_run_path
+        and (args.wandb_download_replace or not osp.exists(latest_path))
+    ):
+        try:
+            wandb.restore(
+                osp.basename(latest_path),
+                run_path=args.wandb_run_path,
+                replace=args.wandb_download_replace,
+                root=osp.dirname(latest_path),
+            )
+        except Exception as e:
+            print(f"No checkpoint restored from {args.wandb_run_path}: {e}")
+    return latest_path if osp.exists(latest_path) else None
+
+
+class PreemptionHandler:
+    """
+    Records the SIGUSR1 sent by Slurm before the time limit (submitted with
+    --signal=USR1@<seconds>). SIGTERM is left alone: it is also what scancel
+    sends, and a cancelled job must not requeue itself.
+    """
+
+    def __init__(self, signals=(signal.SIGUSR1,)):
+        self.received = None
+        for signum in signals:
+            signal.signal(signum, self._handle)
+
+    def _handle(self, signum, frame):
+        self.received = signum
+
+
+def requeue_job():
+    """Requeues the Slurm job, which then resumes from the latest checkpoint."""
+    job_id = os.environ.get("SLURM_JOB_ID")
+    if job_id is None:
+        return
+    if wandb.run is not None:
+        wandb.run.mark_preempting()
+    print(f"Requeuing job {job_id}")
+    subprocess.run(["scontrol", "requeue", job_id])
+
+
+PREEMPTION_CHECK_EVERY = 10  # steps, in data-parallel mode
+
+
+def should_stop(preemption, step):
+    """
+    Whether to stop for a preemption signal. In data-parallel mode the
+    processes agree on it (every PREEMPTION_CHECK_EVERY steps) so that they
+    all leave the loop at the same step.
+    """
+    if not is_distributed():
+        return preemption.received is not None
+    if step % PREEMPTION_CHECK_EVERY:
+        return False
+    flag = torch.tensor([int(preemption.received is not None)])
+    dist.all_reduce(flag, op=dist.ReduceOp.MAX)
+    return bool(flag.item())
+
+
+def get_master_addr():
+    """Host of the rank 0: the first node of the Slurm job, else this one."""
+    nodelist = os.environ.get("SLURM_STEP_NODELIST") or os.environ.get(
+        "SLURM_JOB_NODELIST"
+    )
+    if nodelist:
+        try:
+            hosts = subprocess.run(
+                ["scontrol", "show", "hostnames", nodelist],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout.split()
+            if hosts:
+                return hosts[0]
+        except (OSError, subprocess.CalledProcessError):
+            pass
+    return "127.0.0.1"
+
+
+def init_distributed(backend="gloo"):
+    """
+    Initializes torch.distributed when the job runs several processes, with
+    the rank and world size of Slurm (srun) or of torchrun/spawn (RANK,
+    WORLD_SIZE). Returns (rank, world_size, local_rank).
+    """
+    if "SLURM_PROCID" in os.environ and "RANK" not in os.environ:
+        rank = int(os.environ["SLURM_PROCID"])
+        world_size = int(os.environ.get("SLURM_NTASKS", 1))
+        local_rank = int(os.environ.get("SLURM_LOCALID", 0))
+    else:
+        rank = int(os.environ.get("RANK", 0))
+        world_size = int(os.environ.get("WORLD_SIZE", 1))
+        local_rank = int(os.environ.get("LOCAL_RANK", 0))
+    if world_size > 1:
+        os.environ.setdefault("MASTER_ADDR", get_master_addr())
+        # one port per job, so jobs sharing a node don't collide
+        os.environ.setdefault(
+            "MASTER_PORT", str(29500 + int(os.environ.get("SLURM_JOB_ID", 0)) % 1000)
+        )
+        dist.init_process_group(backend, rank=rank, world_size=world_size)
+        # same validation split on all the processes
+        seed = torch.tensor([torch.initial_seed() % 2**62])
+        dist.broadcast(seed, src=0)
+        torch.manual_seed(seed.item())
+    return rank, world_size, local_rank
+
+
+def default_experiment_name():
+    """
+    Stable across the requeues of a Slurm job, so it resumes its own
+    checkpoints and wandb run.
+    """
+    if os.environ.get("SLURM_ARRAY_JOB_ID"):
+        return (
+            f"test_wandb_{os.environ['SLURM_ARRAY_JOB_ID']}"
+            f"_{os.environ['SLURM_ARRAY_TASK_ID']}"
+        )
+    if os.environ.get("SLURM_JOB_ID"):
+        return f"test_wandb_{os.environ['SLURM_JOB_ID']}"
+    return f"test_wandb_{int(time.time())}"
+
+
+def main(args, data=None, preemptible=True):
+    """
+    Trains the model of the experiment, returns its best validation loss (None
+    if it stopped to be requeued).
+
+    :param data: (train, test) (images, labels) tensors to train on instead of
+        loading the dataset of --data_mode, eg. shared by a sweep
+    :param preemptible: handle the signals of Slurm to checkpoint and requeue
+        the job, off when the process is not the job's (eg. a sweep worker)
+    """
+    loader_kwargs = get_loader_kwargs(
+        num_workers=args.num_workers,
+        pin_memory=args.pin_memory,
+        persistent_workers=args.persistent_workers,
+        prefetch_factor=args.prefetch_factor,
+        device=args.device,
+        sample_transforms=data is None
+        and args.data_mode == "torchvision"
+        and not args.batch_transforms,
     )
-    model = MLP(args.hidden_size).to(args.device)
+    # the training process gets the allocated CPUs not used by the workers
+    torch.set_num_threads(
+        args.num_threads or max(1, get_allocated_cpus() - loader_kwargs["num_workers"])
+    )
+    is_main = args.rank == 0
+    if is_distributed() and not is_main:
+        # the rank 0 downloads and decodes the dataset first
+        dist.barrier()
+    if data is not None:
+        train_loader, validation_loader, test_loader = get_batched_dataloaders(
+            args.batch_size,
+            *data,
+            loader_kwargs=loader_kwargs,
+            eval_batch_size=args.eval_batch_size,
+        )
+    else:
+        train_loader, validation_loader, test_loader = get_dataloaders(
+            batch_size=args.batch_size,
+            data_mode=args.data_mode,
+            data_dir=args.data_dir,
+            loader_kwargs=loader_kwargs,
+            batch_transforms=args.batch_transforms,
+            eval_batch_size=args.eval_batch_size,
+        )
+    if is_distributed() and is_main:
+        dist.barrier()
+    raw_model = MLP(args.hidden_size).to(args.device)
+    model = raw_model
+    if is_distributed():
+        # averages the gradients of the processes during the backward pass
+        model = DistributedDataParallel(
+            raw_model,
+            device_ids=[args.device] if args.device.startswith("cuda") else None,
+        )
 
     optimizer = torch.optim.Adam(model.parameters(), lr=0.001)
     loss_fn = nn.CrossEntropyLoss()
+    forward_loss = make_forward_loss(model, loss_fn, args.exec_mode, args.device)
+
+    train_metrics = MetricAccumulator(args.device)
+    valid_metrics = MetricAccumulator(args.device)
+    step_timer = StepTimer(args.device)
+    throughput = []  # StepTimer metrics of the epochs
+    throughput_path = osp.join(args.log_dir, args.name, "throughput.json")
+    best_valid_loss = float("inf")
+
+    ckpt_dir = osp.join(args.ckpt_dir, args.name)
+    latest_path = osp.join(ckpt_dir, "latest.pt")
+    writer = CheckpointWriter()
+    preemption = PreemptionHandler() if preemptible else PreemptionHandler(())
+    if is_main:
+        # uploaded by wandb each time it is rewritten
+        wandb.save(latest_path, base_path=ckpt_dir, policy="live")
 
-    mean_train_losses = []
-    mean_valid_losses = []
-    valid_acc_list = []
+    start_epoch = 0
+    # only the rank 0 downloads the checkpoint, the others read it once it's there
+    resume_path = find_resume_checkpoint(args, latest_path, download=is_main)
+    if is_distributed():
+        dist.barrier()
+        if not is_main:
+            resume_path = find_resume_checkpoint(args, latest_path, download=False)
+    if resume_path:
+        # a checkpoint found by name must be of this configuration
+        start_epoch, best_valid_loss = restore_checkpoint(
+            resume_path,
+            raw_model,
+            optimizer,
+            args if args.resume == "auto" else None,
+        )
+        if is_main:
+            print(f"Resuming from {resume_path} at epoch {start_epoch + 1}")
+
+    # None unless --profile: the loop then only tests it
+    profiler = None
+    if args.profile and is_main:
+        profiler = make_profiler(args, osp.join(args.log_dir, args.name, "profile"))
+        profiler.start()
 
-    for epoch in range(args.epochs):
+    for epoch in range(start_epoch, args.epochs):
         model.train()
+        set_sampler_epoch(train_loader, epoch)
 
-        train_losses = []
-        valid_losses = []
+        train_metrics.reset()
+        valid_metrics.reset()
+        step_timer.reset()
         for i, (images, labels) in enumerate(train_loader):
-            images = images.to(args.device)
-            labels = labels.to(args.device)
+            images = images.to(args.device, non_blocking=True)
+            labels = labels.to(args.device, non_blocking=True)
+            step_timer.mark("data")
 
             optimizer.zero_grad()
 
-            outputs = model(images)
-            loss = loss_fn(outputs, labels)
+            outputs, loss = forward_loss(images, labels)
+            step_timer.mark("forward")
             loss.backward()
+            step_timer.mark("backward")
             optimizer.step()
+            step_timer.mark("optimizer")
+            step_timer.end_step(labels.size(0))
+            if profiler is not None:
+                profiler.step()
+
+            train_metrics.update(loss, labels)
+            if args.sync_every and (i + 1) % args.sync_every == 0:
+                train_loss = train_metrics.compute()["loss"]
+                if is_main:
+                    print(
+                        "epoch : {}, step : {}, train loss : {:.4f}".format(
+                            epoch + 1, i + 1, train_loss
+                        )
+                    )
 
-            train_losses.append(loss.item())
+            if should_stop(preemption, i + 1):
+                # the current epoch is restarted on resume, from the checkpoint
+                # of the previous one (the weights of a partial epoch are not
+                # saved, they would be trained on its first batches twice)
+                if is_main:
+                    print(f"Received signal {preemption.received}, stopping")
+                writer.close()
+                if profiler is not None:
+                    profiler.stop()
+                if is_main:
+                    write_throughput_summary(throughput_path, throughput, args)
+                    requeue_job()
+                return None
+        step_timer.stop()
 
         model.eval()
-        correct = 0
-        total = 0
         with torch.no_grad():
             for i, (images, labels) in enumerate(validation_loader):
-                images = images.to(args.device)
-                labels = labels.to(args.device)
-
-                outputs = model(images)
-                loss = loss_fn(outputs, labels)
+                images = images.to(args.device, non_blocking=True)
+                labels = labels.to(args.device, non_blocking=True)
 
-                valid_losses.append(loss.item())
+                outputs, loss = forward_loss(images, labels)
 
-                _, predicted = torch.max(outputs.data, 1)
-                correct += (predicted == labels).sum().item()
-                total += labels.size(0)
+                valid_metrics.update(loss, labels, outputs)
 
-        mean_train_losses.append(np.mean(train_losses))
-        mean_valid_losses.append(np.mean(valid_losses))
+        # the only synchronizations of the epoch
+        train_loss = train_metrics.compute()["loss"]
+        valid = valid_metrics.compute()
+        valid_loss, accuracy = valid["loss"], valid["accuracy"]
+        throughput.append(step_timer.compute())
 
-        accuracy = 100 * correct / total
-        valid_acc_list.append(accuracy)
+        # the metrics are the same on all the processes, the best model too
+        is_best = valid_loss < best_valid_loss
+        best_valid_loss = min(best_valid_loss, valid_loss)
+        if not is_main:
+            continue
 
         wandb.log(
             {
-                "train_loss": np.mean(train_losses),
-                "valid_loss": np.mean(valid_losses),
+                "train_loss": train_loss,
+                "valid_loss": valid_loss,
                 "accuracy": accuracy,
+                **{f"perf/{key}": value for key, value in throughput[-1].items()},
             },
             step=epoch + 1,
         )
 
         print(
             "epoch : {}, train loss : {:.4f}, valid loss : {:.4f}, valid acc : {:.2f}%".format(
-                epoch + 1, np.mean(train_losses), np.mean(valid_losses), accuracy
+                epoch + 1, train_loss, valid_loss, accuracy
             )
         )
 
         # save model if best
-        if np.mean(valid_losses) < np.min(mean_valid_losses):
-            torch.save(
-                model.state_dict(),
-                osp.join(args.ckpt_dir, args.name, "best_model.pt"),
-            )
+        if is_best:
+            writer.save(raw_model.state_dict(), osp.join(ckpt_dir, "best_model.pt"))
 
         # save model every 10 epochs
         if (epoch + 1) % 10 == 0:
-            torch.save(
-                model.state_dict(),
-                osp.join(args.ckpt_dir, args.name, f"epoch_{epoch + 1}.pt"),
+            writer.save(
+                raw_model.state_dict(), osp.join(ckpt_dir, f"epoch_{epoch + 1}.pt")
             )
 
+        writer.save(
+            get_checkpoint_state(
+                raw_model, optimizer, epoch + 1, best_valid_loss, args
+            ),
+            latest_path,
+        )
 
-if __name__ == "__main__":
+    writer.close()
+    if profiler is not None:
+        profiler.stop()
+    if is_main:
+        write_throughput_summary(throughput_path, throughput, args)
+        total = summarize_throughput(throughput)
+        print(
+            "throughput : {:,.0f} samples/s, step : {:.2f} ms "
+            "(data {:.0f}%), peak memory : {:.0f} MB".format(
+                total["samples_per_s"],
+                total["step_ms"],
+                total["data_pct"],
+                total["peak_memory_mb"],
+            )
+        )
+    return best_valid_loss
+
+
+def get_parser():
     parser = argparse.ArgumentParser(
         description="simple experiment to test wandb",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
@@ -160,29 +1013,164 @@ if __name__ == "__main__":
     )
     parser.add_argument(
         "--wandb_download_replace",
+        help="replace the local latest checkpoint by the one of --wandb_run_path",
         action="store_true",
         default=False,
     )
 
     # experiment
     parser.add_argument(
-        "--name", help="experiment_name", default=f"test_wandb_{int(time.time())}"
+        "--name",
+        help="experiment_name (default: from the Slurm job id, stable on requeue)",
+        default=default_experiment_name(),
+    )
+    parser.add_argument(
+        "--resume",
+        help="auto: resume from the latest checkpoint of the experiment if any "
+        "(see --wandb_run_path), it must have the same --hidden_size, "
+        "--batch_size and --epochs, never: start over, or a checkpoint path",
+        default="auto",
     )
     parser.add_argument("--log_dir", help="experiment_name", default="logs")
     parser.add_argument("--ckpt_dir", help="experiment_name", default="checkpoints")
 
-    parser.add_argument("--epochs", help="number of epochs", default=10)
-    parser.add_argument("--batch_size", help="batch size", default=128)
-    parser.add_argument("--hidden_size", help="hidden layer size", default=100)
+    parser.add_argument("--epochs", help="number of epochs", type=int, default=10)
+    parser.add_argument(
+        "--batch_size",
+        help="batch size (per process in data-parallel mode)",
+        type=int,
+        default=128,
+    )
+    parser.add_argument(
+        "--hidden_size", help="hidden layer size", type=int, default=100
+    )
+    parser.add_argument(
+        "--eval_batch_size",
+        help="batch size of the validation (no gradients, so larger batches "
+        "are cheaper per sample), 0: --batch_size",
+        type=int,
+        default=1024,
+    )
     parser.add_argument("--device", help="device", default="cuda")
+    parser.add_argument(
+        "--exec_mode",
+        help="eager: fp32, compile: torch.compile of the forward pass and loss, "
+        "bf16: bfloat16 autocast, compile_bf16: both "
+        "(compare them with benchmarks/bench_exec_modes.py)",
+        choices=EXEC_MODES,
+        default="eager",
+    )
+    parser.add_argument(
+        "--dist_backend",
+        help="torch.distributed backend when several processes are launched "
+        "(srun --ntasks=N or torchrun)",
+        choices=("gloo", "nccl"),
+        default="gloo",
+    )
+    parser.add_argument(
+        "--sync_every",
+        help="print the running train loss every N steps (0: once per epoch), "
+        "each print synchronizes with the device",
+        type=int,
+        default=0,
+    )
 
-    args = parser.parse_args()
+    # profiling
+    parser.add_argument(
+        "--profile",
+        help="profile training steps with torch.profiler, the traces and top ops "
+        "tables are written to <log_dir>/<name>/profile",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--profile_wait", help="steps skipped before profiling", type=int, default=5
+    )
+    parser.add_argument(
+        "--profile_warmup",
+        help="steps profiled but discarded before each window",
+        type=int,
+        default=2,
+    )
+    parser.add_argument(
+        "--profile_active", help="steps recorded per window", type=int, default=5
+    )
+    parser.add_argument(
+        "--profile_repeat",
+        help="number of windows (0: until the end)",
+        type=int,
+        default=1,
+    )
 
+    # data
+    parser.add_argument("--data_dir", help="dataset directory", default="./data")
+    parser.add_argument(
+        "--data_mode",
+        help="torchvision: per-sample transforms, "
+        "tensor: memory-mapped tensor with batched indexing",
+        choices=DATA_MODES,
+        default="torchvision",
+    )
+    parser.add_argument(
+        "--batch_transforms",
+        help="torchvision mode: convert the images per batch instead of per sample",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--num_workers",
+        help="data loader workers, -1: the CPUs allocated by Slurm "
+        "(SLURM_CPUS_PER_TASK) minus the training process with cuda or the "
+        "per sample transforms of the torchvision mode, none otherwise",
+        type=int,
+        default=-1,
+    )
+    parser.add_argument(
+        "--pin_memory",
+        help="pin the batches in memory (default: on for cuda)",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+    )
+    parser.add_argument(
+        "--persistent_workers",
+        help="keep the workers between epochs (default: on with workers)",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+    )
+    parser.add_argument(
+        "--num_threads",
+        help="threads of the training process (0: the allocated CPUs not used "
+        "by the data loader workers)",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--prefetch_factor",
+        help="batches loaded in advance by each worker",
+        type=int,
+        default=2,
+    )
+
+    return parser
+
+
+def run(args, data=None, preemptible=True):
+    """
+    Runs the experiment of the parsed arguments (see main), returns its best
+    validation loss.
+    """
     if args.device.startswith("cuda") and not torch.cuda.is_available():
         print("No GPU available, using CPU instead")
         args.device = "cpu"
 
-    print("Using device : ", args.device)
+    args.rank, args.world_size, args.local_rank = init_distributed(args.dist_backend)
+    if args.device.startswith("cuda") and args.world_size > 1:
+        # one GPU per process of the node
+        args.device = f"cuda:{args.local_rank}"
+        torch.cuda.set_device(args.device)
+
+    if args.rank == 0:
+        print("Using device : ", args.device)
+        if args.world_size > 1:
+            print(f"Data-parallel training on {args.world_size} processes")
 
     experiment_name = args.name
     group = "test_wandb"
@@ -193,6 +1181,7 @@ if __name__ == "__main__":
     ckpt_dir = osp.join(args.ckpt_dir, experiment_name)
     os.makedirs(ckpt_dir, exist_ok=True)
 
+    # a single wandb run, logged by the rank 0
     wandb.init(
         project=args.wandb_project,
         name=experiment_name,
@@ -201,7 +1190,20 @@ if __name__ == "__main__":
         config=vars(args),
         dir=log_dir,
         entity=args.wandb_entity,
-        mode=args.wandb_mode,
+        mode=args.wandb_mode if args.rank == 0 else "disabled",
+        # a requeued job continues its run
+        resume="allow",
     )
 
-    main(args)
+    best_valid_loss = main(args, data, preemptible)
+    if best_valid_loss is not None:
+        # a preempted run is left open, it is resumed after the requeue
+        wandb.finish()
+
+    if is_distributed():
+        dist.destroy_process_group()
+    return best_valid_loss
+
+
+if __name__ == "__main__":
+    run(get_parser().parse_args())